@@ -0,0 +1,151 @@
+import sqlite3
+from collections import namedtuple
+
+Ban = namedtuple('Ban', [
+    'ban_id', 'server_id', 'target_id', 'target_name', 'banner_id',
+    'banner_name', 'reason', 'expires', 'ban_type',
+])
+
+COLUMNS = ', '.join(Ban._fields)
+
+# Applied in order; PRAGMA user_version records how many have run.
+MIGRATIONS = [
+    '''
+    CREATE TABLE IF NOT EXISTS bans (
+        ban_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+        server_id INTEGER NOT NULL,
+        target_id INTEGER NOT NULL,
+        target_name TEXT NOT NULL,
+        banner_id INTEGER NOT NULL,
+        banner_name TEXT NOT NULL,
+        reason INTEGER DEFAULT NULL,
+        expires INTEGER DEFAULT 0,
+        ban_type TEXT NOT NULL
+    );
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS bans_target ON bans (target_id);
+    CREATE INDEX IF NOT EXISTS bans_expires ON bans (expires);
+    CREATE INDEX IF NOT EXISTS bans_server_target ON bans (server_id, target_id);
+    ''',
+]
+
+def make_ban(cursor, row):
+    return Ban(*row)
+
+class BanStore:
+    """SQLite storage for timed bans.
+
+    All methods block, DCManager calls them through the 'bans' database
+    worker.  The connection runs in WAL mode with synchronous=NORMAL, so a
+    commit no longer waits for an fsync, and every statement uses bound
+    parameters so sqlite3's statement cache can reuse them.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.migrate()
+
+    def version(self):
+        return self.conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def migrate(self):
+        for version in range(self.version(), len(MIGRATIONS)):
+            self.conn.executescript('BEGIN; {} PRAGMA user_version = {}; COMMIT;'.format(
+                MIGRATIONS[version], version + 1))
+
+    def select(self, sql, params=()):
+        c = self.conn.cursor()
+        c.row_factory = make_ban
+        return c.execute(sql, params).fetchall()
+
+    def add(self, server_id, target_id, target_name, banner_id, banner_name, reason, expires, ban_type):
+        with self.conn:
+            c = self.conn.execute('''
+                INSERT INTO bans
+                (server_id, target_id, target_name, banner_id, banner_name, reason, expires, ban_type)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (int(server_id), int(target_id), target_name, int(banner_id),
+                  banner_name, reason, int(expires), ban_type))
+        return c.lastrowid
+
+    def all(self):
+        return self.select('SELECT {} FROM bans ORDER BY ban_id'.format(COLUMNS))
+
+    def delete(self, ban_ids):
+        ban_ids = list(ban_ids)
+        if not ban_ids:
+            return
+        with self.conn:
+            self.conn.execute('DELETE FROM bans WHERE ban_id IN ({})'.format(
+                ', '.join('?' * len(ban_ids))), ban_ids)
+
+    def close(self):
+        self.conn.close()
+
+class BanCache:
+    """Write-through copy of the active bans, keyed by target_id.
+
+    DCManager updates it alongside every write to the store, so checking a
+    joining member is a dict lookup with no I/O.  verify() compares it
+    against rows freshly read from the store.
+    """
+
+    def __init__(self):
+        self.by_target = {}
+        self.by_id = {}
+        # Not hit/miss: the cache holds every ban, so each lookup is
+        # answered, either with bans or with none
+        self.found = 0
+        self.clean = 0
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def load(self, bans):
+        self.by_target = {}
+        self.by_id = {}
+        for ban in bans:
+            self.add(ban)
+
+    def add(self, ban):
+        self.by_id[ban.ban_id] = ban
+        self.by_target.setdefault(ban.target_id, {})[ban.ban_id] = ban
+
+    def remove(self, ban_ids):
+        for ban_id in ban_ids:
+            ban = self.by_id.pop(ban_id, None)
+            if ban is None:
+                continue
+            bans = self.by_target.get(ban.target_id)
+            if bans is not None:
+                bans.pop(ban_id, None)
+                if not bans:
+                    del self.by_target[ban.target_id]
+
+    def for_target(self, target_id):
+        bans = self.by_target.get(int(target_id))
+        if bans:
+            self.found += 1
+            return sorted(bans.values())
+        self.clean += 1
+        return []
+
+    def bans(self):
+        return list(self.by_id.values())
+
+    def verify(self, bans):
+        """Return (missing, stale) ban ids compared to the given store rows."""
+        stored = {ban.ban_id: ban for ban in bans}
+        missing = sorted(ban_id for ban_id, ban in stored.items() if self.by_id.get(ban_id) != ban)
+        stale = sorted(ban_id for ban_id in self.by_id if ban_id not in stored)
+        return missing, stale
+
+    def stats(self):
+        return {
+            'size': len(self.by_id),
+            'found': self.found,
+            'clean': self.clean,
+        }
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3.5
+"""Time DCManager moderation paths against large synthetic ban lists.
+
+For each ban count a fresh db/ban.db is seeded in a temporary directory
+(1% of bans already due), a stub server with --members members is built,
+and the main moderation paths are timed: expiry, join checks, parse_ban
+target resolution, parse_ban end to end, parse_unban and show_bans.
+Everything runs offline against tests/stubs.py; Discord traffic is
+reported as the number of REST calls plus isend messages made.
+
+    python3 bench/bench_bans.py [--bans 1000,10000,100000] [--members 50000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+sys.path.insert(0, ROOT)
+
+import stubs
+stubs.install_discord()
+
+from banstore import BanStore
+from dbexec import DatabaseExecutor
+from dcmanage import DCManager
+from members import MemberIndex
+
+CONFIG = {
+    'channels': {'dc_mod_control': '1', 'ars_debug': '2', 'dc_mod_logs': '3'},
+    'moderation': {'bulk_concurrency': 4},
+}
+
+def seed(bans, members):
+    store = BanStore('db/ban.db')
+    now = int(time.time())
+    due = max(1, bans // 100)
+    store.conn.executemany('''
+        INSERT INTO bans
+        (server_id, target_id, target_name, banner_id, banner_name, reason, expires, ban_type)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', ((1, 10 ** 17 + i % members, 'user{}'.format(i % members), 42, 'mod', 'spam',
+           now - 60 if i < due else now + 86400, random.choice(('Timeout', 'Shadow Ban')))
+          for i in range(bans)))
+    store.conn.commit()
+    store.close()
+
+class Timer:
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def measure(self, label, coro_factory, repeat=1):
+        calls = dict(self.bot.discord.api_calls)
+        sent = len(self.bot.sent)
+        start = time.perf_counter()
+        for i in range(repeat):
+            await coro_factory(i)
+        elapsed = (time.perf_counter() - start) / repeat
+        rest = sum(self.bot.discord.api_calls.values()) - sum(calls.values())
+        print('  {:<30} {:>10.3f} ms  {:>6} REST  {:>6} isend'.format(
+            label, elapsed * 1000, rest, len(self.bot.sent) - sent))
+
+async def run(bans, members):
+    seed(bans, members)
+
+    bot = stubs.Bot(CONFIG)
+    server = stubs.Server(1, members)
+    bot.discord.servers = [server]
+    bot.members = MemberIndex(bot.discord)
+    bot.members.rebuild()
+    bot.db = DatabaseExecutor(asyncio.get_event_loop())
+
+    start = time.perf_counter()
+    dcmanager = DCManager(bot)
+    print('{} bans, {} members (startup load {:.1f} ms)'.format(
+        bans, members, (time.perf_counter() - start) * 1000))
+
+    origin = stubs.Channel(1, 'mod-control')
+    mod = server.get_member(10 ** 17)
+    timer = Timer(bot)
+
+    await timer.measure('check_for_unbans (1% due)', lambda i: dcmanager.check_for_unbans())
+    await timer.measure('check_for_unbans (idle)', lambda i: dcmanager.check_for_unbans(), 100)
+    await timer.measure('is_join_ban (banned)', lambda i: dcmanager.is_join_ban(server.get_member(10 ** 17 + (bans - 1 - i) % members)), 100)
+    await timer.measure('is_join_ban (clean)', lambda i: dcmanager.is_join_ban(stubs.Member(1, 'new', server)), 1000)
+
+    async def resolve(query):
+        bot.members.search(server, query)
+    await timer.measure('target by id', lambda i: resolve(str(10 ** 17 + i)), 1000)
+    await timer.measure('target by exact name', lambda i: resolve('user{}'.format(i)), 1000)
+    await timer.measure('target by substring', lambda i: resolve('er{}9'.format(i)), 100)
+
+    await timer.measure('parse_ban', lambda i: dcmanager.parse_ban(
+        origin, 'timeout', mod, server, 'user{}'.format(members - 1 - i), '1h', 'bench'), 20)
+    await timer.measure('parse_unban (by ban id)', lambda i: dcmanager.parse_unban(origin.id, str(bans - i)), 20)
+    await timer.measure('show_bans', lambda i: dcmanager.show_bans(origin.id))
+
+    bot.db.shutdown()
+    dcmanager.store.close()
+
+async def main(args):
+    cwd = os.getcwd()
+    for bans in [int(n) for n in args.bans.split(',')]:
+        tmp = tempfile.mkdtemp()
+        try:
+            os.chdir(tmp)
+            os.mkdir('db')
+            await run(bans, args.members)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--bans', default='1000,10000,100000')
+    parser.add_argument('--members', type=int, default=50000)
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
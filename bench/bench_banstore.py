@@ -0,0 +1,75 @@
+#!/usr/bin/env python3.5
+"""Time BanStore lookups and expiry against a 100k row ban table.
+
+The same queries are run against a copy of the table without indexes or
+WAL, laid out the way the old create_db() made it, for comparison.
+
+    python3 bench/bench_banstore.py [rows]
+"""
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from banstore import BanStore, MIGRATIONS
+
+def seed(conn, rows, now):
+    conn.executemany('''
+        INSERT INTO bans
+        (server_id, target_id, target_name, banner_id, banner_name, reason, expires, ban_type)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', ((1, 10 ** 17 + i, 'user{}'.format(i), 42, 'mod', 'spam', now + random.randint(-rows // 100, 86400 * 30),
+           random.choice(('Timeout', 'Shadow Ban'))) for i in range(rows)))
+    conn.commit()
+
+def timed(label, func, repeat=1):
+    start = time.perf_counter()
+    for i in range(repeat):
+        func()
+    elapsed = (time.perf_counter() - start) / repeat
+    print('  {:<28} {:>10.3f} ms'.format(label, elapsed * 1000))
+
+def run(label, conn, store, rows, now):
+    print(label)
+    targets = [10 ** 17 + random.randrange(rows) for i in range(1000)]
+    timed('lookup by target_id', lambda: [conn.execute('SELECT ban_type FROM bans WHERE target_id = ?', (t,)).fetchall()
+                                           for t in targets], 1)
+    timed('lookup server+target', lambda: [conn.execute('SELECT ban_id FROM bans WHERE server_id = 1 AND target_id = ?', (t,)).fetchall()
+                                            for t in targets], 1)
+    timed('expired rows', lambda: conn.execute('SELECT ban_id FROM bans WHERE expires < ?', (now,)).fetchall(), 10)
+    timed('load all expiries', lambda: conn.execute('SELECT ban_id, expires FROM bans').fetchall(), 10)
+
+    def insert():
+        if store is not None:
+            store.add(1, 1, 'new', 42, 'mod', 'spam', now + 60, 'Timeout')
+        else:
+            conn.execute("INSERT INTO bans (server_id, target_id, target_name, banner_id, banner_name, reason, expires, ban_type) "
+                         "VALUES (1, 1, 'new', 42, 'mod', 'spam', {}, 'Timeout')".format(now + 60))
+            conn.commit()
+    timed('insert + commit', insert, 100)
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    now = int(time.time())
+    tmp = tempfile.mkdtemp()
+    try:
+        legacy = sqlite3.connect(os.path.join(tmp, 'legacy.db'))
+        legacy.executescript(MIGRATIONS[0])
+        seed(legacy, rows, now)
+
+        store = BanStore(os.path.join(tmp, 'ban.db'))
+        seed(store.conn, rows, now)
+
+        print('{} bans, 1000 lookups per lookup row'.format(rows))
+        run('legacy (no indexes, rollback journal)', legacy, None, rows, now)
+        run('BanStore (indexed, WAL)', store.conn, store, rows, now)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main()
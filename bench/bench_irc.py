@@ -0,0 +1,160 @@
+#!/usr/bin/env python3.5
+"""Replay IRC traffic through IRCManager and measure the relay.
+
+A local fake IRC server registers the bot and then plays back a
+scenario: a PRIVMSG flood, a netsplit JOIN/QUIT storm, multibyte
+chatter, the same flood cut into tiny TCP writes, or a recorded raw IRC
+log given with --replay.  A stub bot timestamps every isend call, which
+gives lines/s, the IRC->Discord latency distribution and peak Python
+memory for each scenario.
+
+    python3 bench/bench_irc.py [--lines N] [--replay FILE]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+sys.path.insert(0, ROOT)
+
+import stubs
+stubs.install_discord()
+
+from irc import IRCManager
+from routing import Router
+
+CHANNEL = '#airraidsirens'
+
+def config(port):
+    return {
+        'irc': {
+            'ident': 'bench', 'nick': 'Discord', 'realname': 'bench',
+            'server': '127.0.0.1', 'port': port, 'channels': [CHANNEL],
+            'account': '', 'password': '', 'nickserv': '',
+            'relaychannel': CHANNEL, 'mappingchannel': '#mapping',
+            'ignore_nicks': [], 'flood_rate': 1000, 'flood_burst': 1000,
+        },
+        'channels': {'ars_general': '100', 'ars_mapping': '200'},
+    }
+
+def privmsg(seq, text='hello there, how is everyone doing today?'):
+    return ':user{0}!u@host PRIVMSG {1} :{0} {2}'.format(seq, CHANNEL, text)
+
+def flood(n):
+    return [privmsg(i) for i in range(n)]
+
+def netsplit(n):
+    lines = []
+    for i in range(n // 2):
+        lines.append(':split{}!u@host QUIT :hub.net leaf.net'.format(i))
+        lines.append(':split{}!u@host JOIN {}'.format(i, CHANNEL))
+    # Timed lines so the storm still gets a latency sample
+    return lines + [privmsg(i) for i in range(n // 10)]
+
+def multibyte(n):
+    texts = ['héllo wörld ☃ ünïcödé', 'привет мир', 'こんにちは世界', '🙂🙃 emoji 🚀']
+    return [privmsg(i, random.choice(texts)) for i in range(n)]
+
+SCENARIOS = [
+    ('privmsg flood', flood, None),
+    ('netsplit storm', netsplit, None),
+    ('multibyte', multibyte, None),
+    ('fragmented', flood, 7),
+]
+
+class FakeServer:
+    def __init__(self, lines, chunk):
+        self.lines = lines
+        self.chunk = chunk
+        self.sent_at = {}
+
+    async def handle(self, reader, writer):
+        writer.write(b':fake 001 Discord :Welcome\r\n')
+        await writer.drain()
+        # Let the JOIN go out before the traffic starts
+        await asyncio.sleep(0.05)
+
+        for line in self.lines + [privmsg('END', 'done')]:
+            data = (line + '\r\n').encode('utf-8')
+            parts = line.split(' ', 4)
+            if len(parts) > 3 and parts[1] == 'PRIVMSG':
+                self.sent_at[parts[3][1:]] = time.perf_counter()
+            if self.chunk:
+                for i in range(0, len(data), self.chunk):
+                    writer.write(data[i:i + self.chunk])
+                    await writer.drain()
+            else:
+                writer.write(data)
+        await writer.drain()
+
+        try:
+            await reader.read()
+        except ConnectionError:
+            pass
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+async def run(name, lines, chunk):
+    fake = FakeServer(lines, chunk)
+    server = await asyncio.start_server(fake.handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    bot = stubs.Bot(config(port))
+    bot.router = Router(bot)
+    done = asyncio.Event()
+    latencies = []
+
+    def on_send(cid, message):
+        seq = message.split(': ', 1)[-1].split(' ', 1)[0]
+        if seq in fake.sent_at:
+            latencies.append(time.perf_counter() - fake.sent_at[seq])
+        if seq == 'END':
+            done.set()
+    bot.on_send = on_send
+
+    irc = IRCManager(bot)
+    tracemalloc.start()
+    start = time.perf_counter()
+    task = asyncio.ensure_future(irc.loop())
+    await asyncio.wait_for(done.wait(), 120)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    bot.discord.is_closed = True
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    irc.close()
+    server.close()
+
+    print('{:<16} {:>7} lines {:>10.0f} lines/s  p50 {:>7.2f} ms  p99 {:>7.2f} ms  peak {:>7.1f} KiB  isend {}'.format(
+        name, len(lines), len(lines) / elapsed, percentile(latencies, 50) * 1000,
+        percentile(latencies, 99) * 1000, peak / 1024, len(bot.sent)))
+
+async def main(args):
+    if args.replay:
+        with open(args.replay, 'r', encoding='utf-8', errors='replace') as f:
+            lines = [line.rstrip('\r\n') for line in f if line.strip()]
+        await run(os.path.basename(args.replay), lines, None)
+        return
+
+    for name, generate, chunk in SCENARIOS:
+        await run(name, generate(args.lines), chunk)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--lines', type=int, default=20000)
+    parser.add_argument('--replay', help='raw IRC log to replay, one line per message')
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3.5
+"""Time 50 character post previews on large phpBB posts.
+
+Posts are generated in the s9e XML format phpBB 3.2+ stores: nested
+quotes, code blocks, links and smilies, from a few KiB up to a few
+hundred.  The HTMLParser based remove_tags() the pollers used to carry is
+timed alongside preview() for comparison.
+
+    python3 bench/bench_preview.py [posts]
+"""
+import html
+import os
+import random
+import sys
+import time
+
+from html.parser import HTMLParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preview import preview
+
+WORDS = ('siren', 'thunderbolt', 'federal', 'whelen', 'test', 'rotation', 'alert', 'county',
+         'wail', 'growl', '&amp;', '&lt;3', '&quot;loud&quot;', 'École', '警報')
+
+class MLStripper(HTMLParser):
+    def __init__(self):
+        self.reset()
+        self.strict = False
+        self.convert_charrefs= True
+        self.fed = []
+
+    def handle_data(self, d):
+        self.fed.append(d)
+
+    def get_data(self):
+        return ''.join(self.fed)
+
+def remove_tags(text):
+    s = MLStripper()
+    s.feed(html.unescape(text))
+
+    return s.get_data()
+
+def legacy(text):
+    text = remove_tags(text)
+    length = len(text)
+    text = text[:50]
+    if length > len(text):
+        text += "..."
+    return text
+
+def words(n):
+    return ' '.join(random.choice(WORDS) for i in range(n))
+
+def quote(depth):
+    inner = quote(depth - 1) if depth else ''
+    return ('<QUOTE author="user{0}"><s>[quote="user{0}"]</s>{1}{2}<br/>\n<e>[/quote]</e></QUOTE>'
+            .format(depth, inner, words(80)))
+
+def block():
+    kind = random.randrange(4)
+    if kind == 0:
+        return quote(random.randrange(4))
+    if kind == 1:
+        return '<CODE><s>[code]</s>{}<e>[/code]</e></CODE>'.format('x = 1<br/>\n' * 40)
+    if kind == 2:
+        return '<URL url="https://example.com/{0}"><s>[url]</s>https://example.com/{0}<e>[/url]</e></URL> '.format(
+            random.randrange(10 ** 6))
+    return '<E>:)</E> <B><s>[b]</s>{}<e>[/b]</e></B> {}<br/>\n'.format(words(5), words(60))
+
+def post(size):
+    parts = []
+    length = 0
+    while length < size:
+        parts.append(block())
+        length += len(parts[-1])
+    return '<r>' + ''.join(parts) + '</r>'
+
+def timed(label, func, posts):
+    start = time.perf_counter()
+    for text in posts:
+        func(text)
+    elapsed = time.perf_counter() - start
+    print('  {:<12} {:>10.3f} ms/post'.format(label, elapsed * 1000 / len(posts)))
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    random.seed(1)
+    for size in (4 * 1024, 64 * 1024, 512 * 1024):
+        posts = [post(size) for i in range(count if size < 512 * 1024 else max(count // 10, 1))]
+        print('{} KiB posts ({})'.format(size // 1024, len(posts)))
+        timed('remove_tags', legacy, posts)
+        timed('preview', preview, posts)
+
+if __name__ == '__main__':
+    main()
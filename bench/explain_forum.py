@@ -0,0 +1,94 @@
+#!/usr/bin/env python3.5
+"""Time the forum poll query against a realistically sized board.
+
+Builds a throwaway schema with the phpBB tables the poller reads (1M
+posts by default, with phpBB's own indexes and one megathread holding a
+tenth of them, newest post included), then EXPLAIN ANALYZEs
+forums.NEW_POSTS and the query it replaced and prints the poll's plan.
+tests/test_forum_plan.py asserts the plan shape.
+
+    python3 bench/explain_forum.py [--dsn DSN] [--posts N] [--keep]
+"""
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+sys.path.insert(0, ROOT)
+
+from forums import NEW_POSTS
+from pgtest import TABLES, seed
+
+SCHEMA = 'explain_forum'
+
+EXCLUDED = [1, 13, 16, 30, 31, 34]
+
+LEGACY = """SELECT
+    phpbb3_posts.post_id,
+    phpbb3_users.username,
+    phpbb3_topics.topic_title,
+    phpbb3_forums.forum_id, phpbb3_topics.topic_id,
+    phpbb3_posts.post_text AS post_text_trimmed,
+    (SELECT COUNT(*) FROM phpbb3_posts WHERE phpbb3_posts.topic_id = (SELECT topic_id FROM phpbb3_posts ORDER BY post_id DESC LIMIT 1)) AS post_reply_number,
+    phpbb3_posts.post_id AS number_id,
+    COALESCE(phpbb3_ranks.rank_title, 'Registered User') AS group_title
+    FROM phpbb3_posts
+    INNER JOIN phpbb3_users ON phpbb3_posts.poster_id = phpbb3_users.user_id
+    INNER JOIN phpbb3_forums ON phpbb3_forums.forum_id = phpbb3_posts.forum_id
+    INNER JOIN phpbb3_topics ON phpbb3_topics.topic_id = phpbb3_posts.topic_id
+    LEFT JOIN phpbb3_ranks ON phpbb3_ranks.rank_id = phpbb3_users.user_rank
+    WHERE phpbb3_posts.post_id > %s
+    AND phpbb3_forums.forum_id NOT IN (1, 13, 16, 30, 31, 34)
+    AND phpbb3_posts.post_visibility = 1
+    ORDER BY phpbb3_posts.post_id ASC LIMIT %s
+"""
+
+def explain(cursor, sql, params):
+    cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql, params)
+    return cursor.fetchone()[0][0]
+
+def report(label, plan):
+    buffers = plan['Plan'].get('Shared Hit Blocks', 0) + plan['Plan'].get('Shared Read Blocks', 0)
+    print('{:<8} {:>10.3f} ms  {:>8} buffers'.format(label, plan['Execution Time'], buffers))
+
+def build(conn, posts):
+    with conn.cursor() as cursor:
+        cursor.execute('DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0}; SET search_path TO {0}'.format(SCHEMA))
+        cursor.execute(TABLES)
+        start = time.perf_counter()
+        seed(cursor, posts)
+        print('Seeded {} posts in {:.1f}s'.format(posts, time.perf_counter() - start))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dsn', default='dbname=postgres', help='libpq connection string')
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--keep', action='store_true', help='leave the {} schema behind'.format(SCHEMA))
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    try:
+        build(conn, args.posts)
+        with conn.cursor() as cursor:
+            # A typical poll: the watermark sits just behind the newest post
+            mark = args.posts - 30
+            plan = explain(cursor, NEW_POSTS, (mark, EXCLUDED, 20))
+            legacy = explain(cursor, LEGACY, (mark, 20))
+            report('poll', plan)
+            report('legacy', legacy)
+
+            cursor.execute('EXPLAIN ' + NEW_POSTS, (mark, EXCLUDED, 20))
+            print('\n'.join(row[0] for row in cursor.fetchall()))
+    finally:
+        if not args.keep:
+            with conn.cursor() as cursor:
+                cursor.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(SCHEMA))
+        conn.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import asyncio
+import concurrent.futures
+import functools
+import time
+
+class DatabaseExecutor:
+    """Run blocking database calls on a bounded thread pool.
+
+    Every call names the backend it talks to ('forum', 'wiki', 'bans').
+    Each backend gets its own semaphore so one slow database can only tie
+    up its share of the workers, and callers give up after timeout
+    seconds.  A call that timed out keeps its slot until the worker thread
+    actually finishes, so the per-backend limit is never exceeded.
+    observe, if given, is called with (backend, seconds) as each call
+    finishes, timed out or not.
+    """
+
+    def __init__(self, loop, workers=4, limits=None, timeout=30, observe=None):
+        self.loop = loop
+        self.observe = observe
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.limits = limits or {}
+        self.timeout = timeout
+        self.semaphores = {}
+        self.calls = 0
+        self.timeouts = 0
+
+    def semaphore(self, backend):
+        sem = self.semaphores.get(backend)
+        if sem is None:
+            sem = asyncio.Semaphore(self.limits.get(backend, 1))
+            self.semaphores[backend] = sem
+        return sem
+
+    async def run(self, backend, func, *args):
+        sem = self.semaphore(backend)
+        await sem.acquire()
+        start = time.monotonic()
+        try:
+            future = self.loop.run_in_executor(self.executor, functools.partial(func, *args))
+        except Exception:
+            sem.release()
+            raise
+        future.add_done_callback(lambda f: self.finished(backend, sem, start))
+        self.calls += 1
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    def finished(self, backend, sem, start):
+        sem.release()
+        if self.observe is not None:
+            self.observe(backend, time.monotonic() - start)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'timeouts': self.timeouts,
+            'busy': {backend: self.limits.get(backend, 1) - sem._value
+                     for backend, sem in self.semaphores.items()},
+        }
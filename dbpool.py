@@ -0,0 +1,135 @@
+import threading
+import time
+
+class ConnectionPool:
+    """A small pool of DB-API connections to a single backend.
+
+    connect is called to open a new connection and alive(conn) tells
+    whether an idle one can still be used.  Connections come back through
+    release(); broken ones and anything above size are closed, and idle
+    connections older than idle_timeout seconds are dropped rather than
+    reused.  alive() only sees what the client knows, so run() also
+    retries once on a new connection when a reused one turns out to have
+    been closed by the server.  The pool is thread safe.
+    """
+
+    def __init__(self, name, connect, alive, size=2, idle_timeout=300):
+        self.name = name
+        self.connect = connect
+        self.alive = alive
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.idle = []
+        self.in_use = 0
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.closed = 0
+        self.failed = 0
+        self.retried = 0
+
+    def take_idle(self):
+        with self.lock:
+            if not self.idle:
+                return None
+            return self.idle.pop()
+
+    def acquire(self):
+        return self.checkout()[0]
+
+    def checkout(self, fresh=False):
+        while not fresh:
+            entry = self.take_idle()
+            if entry is None:
+                break
+
+            conn, stamp = entry
+            if time.monotonic() - stamp <= self.idle_timeout and self.check(conn):
+                with self.lock:
+                    self.reused += 1
+                    self.in_use += 1
+                return conn, True
+
+            self.discard(conn)
+
+        try:
+            conn = self.connect()
+        except Exception:
+            with self.lock:
+                self.failed += 1
+            raise
+
+        with self.lock:
+            self.created += 1
+            self.in_use += 1
+        return conn, False
+
+    def run(self, func, retry=()):
+        """Return func(conn) on a pooled connection.
+
+        If func raises one of the retry exceptions on a reused connection,
+        the server most likely dropped it (restart, idle kill) along with
+        every other idle one, so those are thrown away and func gets one
+        more go on a new connection.
+        """
+        fresh = False
+        while True:
+            conn, reused = self.checkout(fresh)
+            broken = False
+            try:
+                return func(conn)
+            except retry:
+                broken = True
+                if fresh or not reused:
+                    raise
+            except Exception:
+                broken = True
+                raise
+            finally:
+                self.release(conn, broken)
+
+            with self.lock:
+                self.retried += 1
+            self.close()
+            fresh = True
+
+    def release(self, conn, broken=False):
+        with self.lock:
+            self.in_use -= 1
+            if not broken and len(self.idle) < self.size:
+                self.idle.append((conn, time.monotonic()))
+                return
+
+        self.discard(conn)
+
+    def check(self, conn):
+        try:
+            return self.alive(conn)
+        except Exception:
+            return False
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self.lock:
+            self.closed += 1
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, stamp in idle:
+            self.discard(conn)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'idle': len(self.idle),
+                'in_use': self.in_use,
+                'created': self.created,
+                'reused': self.reused,
+                'closed': self.closed,
+                'failed': self.failed,
+                'retried': self.retried,
+            }
@@ -2,9 +2,15 @@ import asyncio
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import dateparser
+import heapq
 import time
-import re
-import sqlite3
+import traceback
+
+from banstore import Ban, BanCache, BanStore
+from ratelimit import TokenBucket
+
+# Seconds before a ban whose unban failed is tried again
+EXPIRY_RETRY = 60
 
 class DCManager:
     def __init__(self, bot):
@@ -12,56 +18,124 @@ class DCManager:
         self.config = bot.config
         self.discord = self.bot.discord
         self.control_channels = [self.config['channels']['dc_mod_control'], self.config['channels']['ars_debug']]
-        self.conn = None
-        self.create_db()
-
-
-    def create_db(self):
-        self.conn = sqlite3.connect('db/ban.db')
-        c = self.conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS bans (
-            ban_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-            server_id INTEGER NOT NULL,
-            target_id INTEGER NOT NULL,
-            target_name TEXT NOT NULL,
-            banner_id INTEGER NOT NULL,
-            banner_name TEXT NOT NULL,
-            reason INTEGER DEFAULT NULL,
-            expires INTEGER DEFAULT 0,
-            ban_type TEXT NOT NULL
-        )''')
-        self.conn.commit()
-
-
-    def add_db_ban(self, server, target, banner, reason, expires, ban_type):
-        escaped = re.sub("'", "''", reason)
-        c = self.conn.cursor()
-        c.execute('''
-            INSERT INTO bans
-            (server_id, target_id, target_name, banner_id, banner_name, reason, expires, ban_type)
-            VALUES
-            ({}, {}, '{}', {}, '{}', '{}', {}, '{}')
-        '''.format(server,
-                   target.id, re.sub("'", "''", target.display_name),
-                   banner.id, re.sub("'", "''", banner.display_name),
-                   escaped, expires, ban_type))
-        self.conn.commit()
+        # Queries run on the 'bans' database worker, not the loop thread
+        self.store = BanStore('db/ban.db')
+        # Min-heap of (expires, ban_id); pending maps ban_id -> expires and
+        # decides which heap entries are still live.
+        self.expiries = []
+        self.pending = {}
+        self.expiry_changed = asyncio.Event()
+        self.cache = BanCache()
+        self.role_cache = {}
+        modconf = self.config.get('moderation', {})
+        self.bulk_slots = asyncio.Semaphore(int(modconf.get('bulk_concurrency', 4)))
+        # Per server, Discord's role and member routes are bucketed per guild
+        self.bulk_rate = modconf.get('bulk_rate', 1)
+        self.bulk_burst = modconf.get('bulk_burst', 5)
+        self.bulk_buckets = {}
+        self.load_bans()
+        metrics = bot.metrics
+        metrics.gauge('ban_expiries_pending', 'Bans waiting to expire', func=lambda: len(self.pending))
+        metrics.gauge('ban_cache_size', 'Bans held in the ban cache', func=lambda: len(self.cache))
+        metrics.counter('ban_lookups_found_total', 'Ban lookups that found a ban', func=lambda: self.cache.found)
+        metrics.counter('ban_lookups_clean_total', 'Ban lookups that found no ban', func=lambda: self.cache.clean)
+
+
+    async def run_store(self, func, *args):
+        return await self.bot.db.run('bans', func, *args)
+
+
+    def schedule_expiry(self, ban_id, expires):
+        self.pending[ban_id] = expires
+        heapq.heappush(self.expiries, (expires, ban_id))
+        self.expiry_changed.set()
+
+
+    def cancel_expiry(self, ban_id):
+        # The heap entry is skipped once it surfaces
+        self.pending.pop(ban_id, None)
+
+
+    def load_bans(self):
+        # Runs once at startup, before the loop is serving events
+        bans = self.store.all()
+        self.cache.load(bans)
+        self.pending = {ban.ban_id: ban.expires for ban in bans}
+        self.expiries = [(ban.expires, ban.ban_id) for ban in bans]
+        heapq.heapify(self.expiries)
+
+
+    async def check_cache(self):
+        bans = await self.run_store(self.store.all)
+        missing, stale = self.cache.verify(bans)
+        if missing or stale:
+            await self.bot.alert_error('Ban cache out of sync, reloading (missing {}, stale {})'.format(missing, stale))
+            self.cache.load(bans)
+        return missing, stale
+
+
+    def due_expiries(self, now):
+        due = []
+        while self.expiries and self.expiries[0][0] <= now:
+            expires, ban_id = heapq.heappop(self.expiries)
+            if self.pending.get(ban_id) == expires:
+                del self.pending[ban_id]
+                due.append(ban_id)
+        return due
+
+
+    async def add_db_ban(self, server, target, banner, reason, expires, ban_type):
+        ban_id = await self.run_store(self.store.add, server, target.id, target.display_name,
+                                      banner.id, banner.display_name, reason, expires, ban_type)
+        self.cache.add(Ban(ban_id, int(server), int(target.id), target.display_name, int(banner.id),
+                           banner.display_name, reason, int(expires), ban_type))
+        self.schedule_expiry(ban_id, expires)
 
 
     async def check_for_unbans(self):
-        epoch = int(abs(time.mktime(datetime.now().timetuple())))
-        c = self.conn.cursor()
-        c.execute('''
-            SELECT
-            server_id, target_id, target_name, banner_id,
-            banner_name, reason, expires, ban_type
-            FROM bans WHERE expires < {}
-        '''.format(epoch))
-        for row in c.fetchall():
-            await self.unban(row[0], row[1], row[2], row[3], row[4], row[5], row[7], 'expiring')
-        c.execute('''DELETE FROM bans WHERE expires < {}'''.format(epoch))
-        self.conn.commit()
+        # Same clock as wait_for_expiry, or it wakes up before anything is due
+        due = self.due_expiries(time.time())
+        if not due:
+            return
+
+        # A ban leaves the cache and the store only once its unban went
+        # through; anything that failed stays banned and is tried again
+        done = []
+        for ban_id in due:
+            ban = self.cache.by_id.get(ban_id)
+            if ban is not None:
+                try:
+                    await self.unban(ban.server_id, ban.target_id, ban.target_name, ban.banner_id,
+                                     ban.banner_name, ban.reason, ban.ban_type, 'expiring')
+                except Exception:
+                    await self.bot.alert_error("Unable to expire ban {}: {}".format(ban_id, traceback.format_exc()))
+                    self.schedule_expiry(ban_id, int(time.time()) + EXPIRY_RETRY)
+                    continue
+            done.append(ban_id)
+
+        if not done:
+            return
+
+        try:
+            await self.run_store(self.store.delete, done)
+        except Exception:
+            await self.bot.alert_error("Unable to delete expired bans {}: {}".format(done, traceback.format_exc()))
+            for ban_id in done:
+                self.schedule_expiry(ban_id, int(time.time()) + EXPIRY_RETRY)
+            return
+        self.cache.remove(done)
+
+
+    async def wait_for_expiry(self):
+        timeout = None
+        if self.expiries:
+            timeout = max(0, self.expiries[0][0] - time.time())
+
+        try:
+            await asyncio.wait_for(self.expiry_changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.expiry_changed.clear()
 
 
     async def unban(self, server_id, target_id, target_name, banner_id, banner_name, reason, ban_type, why):
@@ -75,23 +149,14 @@ class DCManager:
             await self.bot.alert_error('Unable to find server {}'.format(server_id))
             return
 
-        target_node = None
-        for member in server_node.members:
-            if str(member.id) == str(target_id):
-                target_node = member
-                break
+        target_node = self.bot.members.get(server_node, target_id)
 
         if not target_node:
             await self.bot.alert_error('Unable to find member {}'.format(target_id))
             return
 
-        for role in server_node.roles:
-            if role in target_node.roles:
-                await self.discord.remove_roles(target_node, role)
-            try:
-                target_node.roles.remove(role)
-            except ValueError:
-                continue
+        await self.discord.replace_roles(target_node)
+        target_node.roles = [server_node.default_role]
 
         log_message = "[unban] {} {} ban for {} ({}) by {} ({}) ({})".format(
             why, ban_type, target_name, target_id, banner_name, banner_id, reason
@@ -103,60 +168,51 @@ class DCManager:
     async def loop(self):
         await self.bot.discord.wait_until_ready()
         while not self.bot.discord.is_closed:
-            await self.check_for_unbans()
-            await asyncio.sleep(3)
-
+            try:
+                await self.check_for_unbans()
+            except Exception:
+                await self.bot.alert_error("Unban exception: {}".format(traceback.format_exc()))
+            await self.wait_for_expiry()
 
-    async def do_shadow_ban(self, server, target, reason, want_message=True):
-        shadowban_role = None
-        for role in server.roles:
-            if 'shadow' in role.name.lower():
-                shadowban_role = role
-                break
 
-        if not shadowban_role:
-            await self.bot.alert_error("BUG: Unable to find shadow ban role!")
-            return
+    def find_role(self, server, name):
+        roles = self.role_cache.setdefault(server.id, {})
+        if name not in roles:
+            roles[name] = None
+            for role in server.roles:
+                if name in role.name.lower():
+                    roles[name] = role
+                    break
+        return roles[name]
 
-        for role in server.roles:
-            if role in target.roles:
-                await self.discord.remove_roles(target, role)
-            try:
-                target.roles.remove(role)
-            except ValueError:
-                continue
 
-        await self.discord.add_roles(target, shadowban_role)
+    def forget_roles(self, server):
+        self.role_cache.pop(server.id, None)
 
-        if want_message:
-            await self.discord.send_message(target, reason)
 
+    async def apply_ban_role(self, server, target, name, reason, want_message):
+        ban_role = self.find_role(server, name)
 
-    async def do_timeout(self, server, target, reason, want_message=True):
-        timeout_role = None
-        for role in server.roles:
-            if 'timeout' in role.name.lower():
-                timeout_role = role
-                break
-
-        if not timeout_role:
-            await self.bot.alert_error("BUG: Unable to find timeout ban role!")
+        if not ban_role:
+            await self.bot.alert_error("BUG: Unable to find {} ban role!".format(name))
             return
 
-        for role in server.roles:
-            if role in target.roles:
-                await self.discord.remove_roles(target, role)
-            try:
-                target.roles.remove(role)
-            except ValueError:
-                continue
-
-        await self.discord.add_roles(target, timeout_role)
+        # One request swaps every role for the ban role
+        await self.discord.replace_roles(target, ban_role)
+        target.roles = [server.default_role, ban_role]
 
         if want_message:
             await self.discord.send_message(target, reason)
 
 
+    async def do_shadow_ban(self, server, target, reason, want_message=True):
+        await self.apply_ban_role(server, target, 'shadow', reason, want_message)
+
+
+    async def do_timeout(self, server, target, reason, want_message=True):
+        await self.apply_ban_role(server, target, 'timeout', reason, want_message)
+
+
     async def move_to_timeout_voice(self, server, target):
         banned_channel = None
         for channel in server.channels:
@@ -175,16 +231,12 @@ class DCManager:
 
 
     async def is_join_ban(self, member):
-        c = self.conn.cursor()
-        c.execute('''
-            SELECT ban_type FROM bans WHERE target_id = {}
-        '''.format(member.id))
-        rows = c.fetchall()
+        rows = self.cache.for_target(member.id)
 
         if len(rows) == 0:
             return False
 
-        ban_type = rows[0][0]
+        ban_type = rows[0].ban_type
 
         if 'shadow' in str(ban_type).lower():
             await self.do_shadow_ban(member.server, member, None, False)
@@ -207,64 +259,54 @@ class DCManager:
             await self.bot.isend(origin, 'Ban ID must be a positive number')
             return
 
-        c = self.conn.cursor()
         if ban_int < 10000000000000:
-            c.execute('''
-                SELECT
-                server_id, target_id, target_name, banner_id,
-                banner_name, reason, expires, ban_type
-                FROM bans WHERE ban_id = {}
-            '''.format(ban_int))
+            rows = [self.cache.by_id[ban_int]] if ban_int in self.cache.by_id else []
         else:
-            c.execute('''
-                SELECT
-                server_id, target_id, target_name, banner_id,
-                banner_name, reason, expires, ban_type
-                FROM bans WHERE target_id = {}
-            '''.format(ban_int))
-        rows = c.fetchall()
+            rows = self.cache.for_target(ban_int)
 
         if len(rows) == 0:
             await self.bot.isend(origin, 'Ban {} not found'.format(ban_int))
             return
 
-        for row in rows:
-            await self.bot.isend(origin, 'Unbanning {}...'.format(row[2]))
-            await self.unban(row[0], row[1], row[2], row[3], row[4], row[5], row[7], 'removing')
+        for ban in rows:
+            self.cancel_expiry(ban.ban_id)
+        self.cache.remove([ban.ban_id for ban in rows])
+
+        for ban in rows:
+            await self.bot.isend(origin, 'Unbanning {}...'.format(ban.target_name))
+            await self.unban(ban.server_id, ban.target_id, ban.target_name, ban.banner_id,
+                             ban.banner_name, ban.reason, ban.ban_type, 'removing')
+
+        await self.run_store(self.store.delete, [ban.ban_id for ban in rows])
 
-        if ban_int < 10000000000000:
-            c.execute('''DELETE FROM bans WHERE ban_id = {}'''.format(ban_int))
-        else:
-            c.execute('''DELETE FROM bans WHERE target_id = {}'''.format(ban_int))
 
-        self.conn.commit()
+    async def show_cache(self, origin):
+        missing, stale = await self.check_cache()
+        stats = self.cache.stats()
+        await self.bot.isend(origin, 'Ban cache: {} bans, {} lookups found a ban, {} found none, {}'.format(
+            stats['size'], stats['found'], stats['clean'],
+            'in sync' if not missing and not stale else 'reloaded ({} missing, {} stale)'.format(len(missing), len(stale))))
 
 
     async def show_bans(self, origin):
         attrs = ['years', 'months', 'days', 'hours', 'minutes', 'seconds']
         human_readable = lambda delta: ['%d %s' % (getattr(delta, attr), getattr(delta, attr) > 1 and attr or attr[:-1]) for attr in attrs if getattr(delta, attr)]
 
-        c = self.conn.cursor()
-        c.execute('''
-            SELECT
-            ban_id, target_id, target_name, banner_id,
-            banner_name, reason, expires, ban_type
-            FROM bans
-        ''')
-        rows = c.fetchall()
+        rows = sorted(self.cache.bans())
 
         if len(rows) == 0:
             await self.bot.isend(origin, 'No bans in place')
         else:
             await self.bot.isend(origin, '{} ban{}:'.format(len(rows), 's' if len(rows) != 1 else ''))
             for ban in rows:
-                t = datetime.fromtimestamp(int(ban[6]))
+                t = datetime.fromtimestamp(int(ban.expires))
                 rd = relativedelta(t, datetime.now())
                 time_readable_ = human_readable(rd)
                 time_readable = ' '.join(time_readable_)
 
                 await self.bot.isend(origin, 'Ban ID: {}\nType: {}\nExpires: {}\nModerator: {} ({})\nUser: {} ({})\nReason: {}\n\n'.format(
-                    ban[0], ban[7], time_readable, ban[4], ban[3], ban[2], ban[1], ban[5]
+                    ban.ban_id, ban.ban_type, time_readable, ban.banner_name, ban.banner_id,
+                    ban.target_name, ban.target_id, ban.reason
                 ))
 
 
@@ -302,14 +344,7 @@ class DCManager:
         else:
             new_message = message
 
-        target_nodes = []
-        for member in server.members:
-            if target.lower() == member.display_name.lower() or target.lower() == str(member.id):
-                target_nodes = [member]
-                break
-
-            if target.lower() in member.display_name.lower():
-                target_nodes.append(member)
+        target_nodes = self.bot.members.search(server, target)
 
         if len(target_nodes) < 1:
             await self.bot.isend(origin.id, 'Unable to find user {}'.format(target))
@@ -339,10 +374,10 @@ class DCManager:
 
         if 'shadow' in ban_type:
             await self.do_shadow_ban(server, target_node, new_message)
-            self.add_db_ban(server.id, target_node, banner, new_message, epoch + seconds, 'Shadow Ban')
+            await self.add_db_ban(server.id, target_node, banner, new_message, epoch + seconds, 'Shadow Ban')
         else:
             await self.do_timeout(server, target_node, new_message)
-            self.add_db_ban(server.id, target_node, banner, new_message, epoch + seconds, 'Timeout')
+            await self.add_db_ban(server.id, target_node, banner, new_message, epoch + seconds, 'Timeout')
 
         await self.move_to_timeout_voice(server, target_node)
 
@@ -350,43 +385,68 @@ class DCManager:
         await self.bot.isend(self.config['channels']['dc_mod_logs'], log_message)
 
 
-    async def on_message(self, message):
-        timeout_bans = ['!timeout', '!addtimeout', '!to']
-        shadow_bans = ['!sb', '!shadow', '!shadowban']
-        showbans = ['!bans', '!showbans', '!listbans']
-        unban_cmd = ['!unban', '!ub']
+    async def bulk_pace(self, server):
+        bucket = self.bulk_buckets.get(server.id)
+        if bucket is None:
+            bucket = self.bulk_buckets[server.id] = TokenBucket(self.bulk_rate, self.bulk_burst)
+        while True:
+            delay = bucket.delay()
+            if delay <= 0:
+                bucket.take()
+                return
+            await asyncio.sleep(delay)
 
-        if str(message.author.id) == str(self.discord.user.id):
-            return
 
-        if message.channel and message.channel.id in self.control_channels:
-            parts = message.content.split(' ')
-            if len(parts) == 0:
-                return # ???
-
-            cmd = parts[0]
-
-            if len(parts) >= 3:
-                if cmd.lower() in timeout_bans or cmd.lower() in shadow_bans:
-                    ban_type = ''
-                    if cmd.lower() in shadow_bans:
-                        ban_type = 'shadow'
-                    else:
-                        ban_type = 'timeout'
-
-                    target = parts[1]
-                    time = parts[2]
-                    reason = ' '.join(parts[3:])
-                    await self.parse_ban(message.channel, ban_type, message.author, message.server, target, time, reason)
-                elif cmd.lower() in showbans:
-                    await self.show_bans(message.channel.id)
-                elif cmd.lower() in unban_cmd:
-                    ban_id = parts[1]
-                    await self.parse_unban(message.channel.id, ban_id)
-            elif len(parts) >= 2:
-                if cmd.lower() in unban_cmd:
-                    ban_id = parts[1]
-                    await self.parse_unban(message.channel.id, ban_id)
-            else:
-                if cmd.lower() in showbans:
-                    await self.show_bans(message.channel.id)
+    async def bulk_ban(self, origin, ban_type, banner, server, targets, ban_time, message):
+        async def limited(target):
+            # Each ban costs a role swap and a voice move on the server's
+            # buckets; pace them under Discord's limits instead of leaning
+            # on discord.py's 429 sleeps, and cap how many run at once
+            async with self.bulk_slots:
+                await self.bulk_pace(server)
+                await self.parse_ban(origin, ban_type, banner, server, target, ban_time, message)
+
+        await asyncio.gather(*[limited(target) for target in targets if target])
+
+
+    def register_commands(self, dispatcher):
+        control = self.control_channels
+        dispatcher.command(['!timeout', '!addtimeout', '!to'], self.cmd_timeout, 2, control)
+        dispatcher.command(['!sb', '!shadow', '!shadowban'], self.cmd_shadow_ban, 2, control)
+        dispatcher.command(['!masstimeout', '!massto'], self.cmd_bulk_timeout, 2, control)
+        dispatcher.command(['!massshadow', '!masssb'], self.cmd_bulk_shadow_ban, 2, control)
+        dispatcher.command(['!bans', '!showbans', '!listbans'], self.cmd_show_bans, 0, control)
+        dispatcher.command(['!unban', '!ub'], self.cmd_unban, 1, control)
+        dispatcher.command(['!bancache'], self.cmd_ban_cache, 0, control)
+
+
+    async def cmd_timeout(self, message, parts):
+        await self.parse_ban(message.channel, 'timeout', message.author, message.server,
+                             parts[1], parts[2], ' '.join(parts[3:]))
+
+
+    async def cmd_shadow_ban(self, message, parts):
+        await self.parse_ban(message.channel, 'shadow', message.author, message.server,
+                             parts[1], parts[2], ' '.join(parts[3:]))
+
+
+    async def cmd_bulk_timeout(self, message, parts):
+        await self.bulk_ban(message.channel, 'timeout', message.author, message.server,
+                            parts[1].split(','), parts[2], ' '.join(parts[3:]))
+
+
+    async def cmd_bulk_shadow_ban(self, message, parts):
+        await self.bulk_ban(message.channel, 'shadow', message.author, message.server,
+                            parts[1].split(','), parts[2], ' '.join(parts[3:]))
+
+
+    async def cmd_show_bans(self, message, parts):
+        await self.show_bans(message.channel.id)
+
+
+    async def cmd_unban(self, message, parts):
+        await self.parse_unban(message.channel.id, parts[1])
+
+
+    async def cmd_ban_cache(self, message, parts):
+        await self.show_cache(message.channel.id)
@@ -0,0 +1,87 @@
+import asyncio
+import time
+from collections import deque
+
+from ratelimit import TokenBucket
+
+MESSAGE_LIMIT = 2000
+
+class Coalescer:
+    """Per-channel outbound queue in front of Discord.
+
+    Lines queued for a channel within delay seconds of each other are
+    joined with newlines into as few messages as the 2000 character limit
+    allows.  Each channel has its own token bucket matching Discord's
+    per-channel send limit, so bursts wait here instead of bouncing off
+    429s.  send(cid, content) does the actual delivery; observe, if given,
+    is called with (cid, seconds since the oldest line was queued) after
+    each message goes out.
+    """
+
+    def __init__(self, send, delay=0.25, rate=1, burst=5, observe=None):
+        self.send = send
+        self.observe = observe
+        self.delay = delay
+        self.rate = rate
+        self.burst = burst
+        self.queues = {}
+        self.buckets = {}
+        self.tasks = {}
+        self.lines = 0
+        self.messages = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+    def put(self, cid, message):
+        self.queues.setdefault(cid, deque()).append((time.monotonic(), message))
+        if cid not in self.tasks:
+            self.tasks[cid] = asyncio.ensure_future(self.flusher(cid))
+
+    def take_batch(self, queue):
+        stamp, content = queue.popleft()
+        while queue and len(content) + 1 + len(queue[0][1]) <= MESSAGE_LIMIT:
+            content += '\n' + queue.popleft()[1]
+        return stamp, content
+
+    async def flusher(self, cid):
+        queue = self.queues[cid]
+        bucket = self.buckets.get(cid)
+        if bucket is None:
+            bucket = self.buckets[cid] = TokenBucket(self.rate, self.burst)
+
+        try:
+            await asyncio.sleep(self.delay)
+            while queue:
+                wait = bucket.delay()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                bucket.take()
+
+                before = len(queue)
+                stamp, content = self.take_batch(queue)
+                self.lines += before - len(queue)
+                self.messages += 1
+                try:
+                    await self.send(cid, content)
+                except Exception as ex:
+                    print("Error sending to {}: {}".format(cid, ex))
+
+                self.last_latency = time.monotonic() - stamp
+                self.max_latency = max(self.max_latency, self.last_latency)
+                if self.observe is not None:
+                    self.observe(cid, self.last_latency)
+        finally:
+            del self.tasks[cid]
+
+    def depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def stats(self):
+        return {
+            'depth': self.depth(),
+            'lines': self.lines,
+            'messages': self.messages,
+            'last_latency': self.last_latency,
+            'max_latency': self.max_latency,
+        }
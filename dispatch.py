@@ -0,0 +1,67 @@
+import asyncio
+import traceback
+from collections import namedtuple
+
+Command = namedtuple('Command', ['handler', 'min_args', 'channels'])
+
+class Dispatcher:
+    """Table-driven routing of Discord messages to handlers.
+
+    Listeners see every message; commands are looked up by their first
+    word in a dict built at registration time, and only when the message
+    starts with the command prefix.  Everything a message triggers runs
+    concurrently, and one handler failing doesn't affect the others.
+    """
+
+    def __init__(self, bot, prefix='!'):
+        self.bot = bot
+        self.prefix = prefix
+        self.commands = {}
+        self.listeners = []
+
+    def command(self, names, handler, min_args=0, channels=None):
+        """Register handler(message, parts) for every alias in names.
+
+        min_args is the number of words required after the command and
+        channels, when given, limits it to those channel IDs."""
+        if channels is not None:
+            channels = frozenset(str(cid) for cid in channels)
+        for name in names:
+            self.commands[name.lower()] = Command(handler, min_args, channels)
+
+    def listen(self, handler):
+        self.listeners.append(handler)
+
+    def match(self, message):
+        content = message.content
+        if not content.startswith(self.prefix):
+            return None
+
+        parts = content.split(' ')
+        command = self.commands.get(parts[0].lower())
+        if command is None or len(parts) <= command.min_args:
+            return None
+        if command.channels is not None and (message.channel is None or
+                                             str(message.channel.id) not in command.channels):
+            return None
+        return command.handler(message, parts)
+
+    async def guard(self, job):
+        try:
+            await job
+        except Exception:
+            await self.bot.alert_error("Handler exception: {}".format(traceback.format_exc()))
+
+    async def dispatch(self, message):
+        if str(message.author.id) == str(self.bot.discord.user.id):
+            return
+
+        jobs = [listener(message) for listener in self.listeners]
+        job = self.match(message)
+        if job is not None:
+            jobs.append(job)
+
+        if len(jobs) == 1:
+            await self.guard(jobs[0])
+        elif jobs:
+            await asyncio.gather(*[self.guard(job) for job in jobs])
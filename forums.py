@@ -1,114 +1,215 @@
 import asyncio
 import base64
 import psycopg2
+import re
+import time
 import traceback
-import xml.etree
-import html
 
-from html.parser import HTMLParser
-
-class MLStripper(HTMLParser):
-    def __init__(self):
-        self.reset()
-        self.strict = False
-        self.convert_charrefs= True
-        self.fed = []
-
-    def handle_data(self, d):
-        self.fed.append(d)
-
-    def get_data(self):
-        return ''.join(self.fed)
-
-def remove_tags(text):
-    s = MLStripper()
-    s.feed(html.unescape(text))
-
-    return s.get_data()
+from dbpool import ConnectionPool
+from poller import Poller
+from preview import preview
+from watermark import Watermark
+
+# Walks the phpbb3_posts primary key from the watermark; everything else
+# is a primary key lookup per row.  A post is a reply unless it is the
+# first post of its topic.
+NEW_POSTS = """SELECT
+    phpbb3_posts.post_id,
+    phpbb3_users.username,
+    phpbb3_topics.topic_title,
+    phpbb3_posts.forum_id, phpbb3_posts.topic_id,
+    phpbb3_posts.post_text AS post_text_trimmed,
+    CASE WHEN phpbb3_topics.topic_first_post_id = phpbb3_posts.post_id THEN 0 ELSE 1 END AS post_reply_number,
+    phpbb3_posts.post_id AS number_id,
+    COALESCE(phpbb3_ranks.rank_title, 'Registered User') AS group_title
+    FROM phpbb3_posts
+    INNER JOIN phpbb3_users ON phpbb3_posts.poster_id = phpbb3_users.user_id
+    INNER JOIN phpbb3_topics ON phpbb3_topics.topic_id = phpbb3_posts.topic_id
+    LEFT JOIN phpbb3_ranks ON phpbb3_ranks.rank_id = phpbb3_users.user_rank
+    WHERE phpbb3_posts.post_id > %s
+    AND phpbb3_posts.forum_id <> ALL(%s)
+    AND phpbb3_posts.post_visibility = 1
+    ORDER BY phpbb3_posts.post_id ASC LIMIT %s
+"""
+
+# Inserts only.  NEW_POSTS walks post_id forward from the watermark, so a
+# post approved after the watermark has passed it can't be announced and
+# waking up for it would just be an empty poll.
+#
+# A one-off step: run it by hand as the owner of phpbb3_posts, or let
+# forums.install_trigger create it when pg_trigger shows it is missing.
+# Never drop and recreate it on the live board, DROP TRIGGER takes an
+# ACCESS EXCLUSIVE lock and every forum query queues behind it.
+NOTIFY_TRIGGER = """
+CREATE OR REPLACE FUNCTION {channel}_notify() RETURNS trigger AS $$
+BEGIN
+    IF NEW.post_visibility = 1 THEN
+        PERFORM pg_notify('{channel}', NEW.post_id::text);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER {channel}_trigger
+    AFTER INSERT ON phpbb3_posts
+    FOR EACH ROW EXECUTE PROCEDURE {channel}_notify();
+"""
+
+TRIGGER_EXISTS = "SELECT 1 FROM pg_trigger WHERE tgrelid = 'phpbb3_posts'::regclass AND tgname = %s"
 
 class Forum:
     def __init__(self, bot):
-        self.read_posts = []
         self.bot = bot
         self.config = bot.config
-        self.forumdb = None
+        self.pool = ConnectionPool('forum', self.connectDb, lambda db: not db.closed,
+            size=int(self.config['forum_mysql'].get('pool_size', 2)),
+            idle_timeout=int(self.config['forum_mysql'].get('idle_timeout', 300)))
+        self.last_post = Watermark('db/forum.mark')
+        self.batch_size = int(self.config['forums'].get('batch_size', 20))
+        self.excluded_forums = [int(fid) for fid in self.config['forums'].get('excluded_forums', [1, 13, 16, 30, 31, 34])]
+        self.poller = Poller('forum', bot.metrics,
+            min_interval=self.config['forums'].get('poll_min', self.config['forums'].get('check_rate', 1)),
+            max_interval=self.config['forums'].get('poll_max', 60))
+        self.listen_enabled = bool(self.config['forums'].get('listen', False))
+        self.listen_channel = self.config['forums'].get('notify_channel', 'phpbb3_new_post')
+        self.listen_timeout = int(self.config['forums'].get('listen_timeout', 300))
+        self.install_trigger = bool(self.config['forums'].get('install_trigger', False))
+        self.trigger_checked = False
+        self.listener = None
+        self.listener_fd = None
+        self.listen_attempt = None
+        self.wakeup = asyncio.Event()
 
     def connectDb(self):
+        forumdb = psycopg2.connect(
+            user=self.config['forum_mysql']['user'],
+            dbname=self.config['forum_mysql']['db'])
+        # Pooled connections must not sit idle inside a transaction
+        forumdb.autocommit = True
+        return forumdb
+
+    def query_posts(self):
+        # Runs on a database worker thread
         try:
-            self.forumdb = psycopg2.connect(
-                user=self.config['forum_mysql']['user'],
-                dbname=self.config['forum_mysql']['db'])
-        except Exception as ex:
+            return self.pool.run(self.read_posts, retry=(psycopg2.OperationalError, psycopg2.InterfaceError))
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as ex:
             print("Error connecting to PostgreSQL: {}".format(ex))
+            return None
+
+    def read_posts(self, forumdb):
+        with forumdb.cursor() as cursor:
+            if self.last_post.value is None:
+                # First run, start from the newest post instead of
+                # announcing the whole board
+                cursor.execute("SELECT COALESCE(MAX(post_id), 0) FROM phpbb3_posts")
+                self.last_post.save(cursor.fetchone()[0])
+                return []
+
+            cursor.execute(NEW_POSTS, (self.last_post.value, self.excluded_forums, self.batch_size))
+            return cursor.fetchall()
 
     async def fetch_post(self):
         try:
-            self.connectDb()
-            if self.forumdb is None: return False
-            with self.forumdb.cursor() as cursor:
-                sql = """SELECT
-                         phpbb3_posts.post_id,
-                         phpbb3_users.username,
-                         phpbb3_topics.topic_title,
-                         phpbb3_forums.forum_id, phpbb3_topics.topic_id,
-                         phpbb3_posts.post_text AS post_text_trimmed,
-                         (SELECT COUNT(*) FROM phpbb3_posts WHERE phpbb3_posts.topic_id = (SELECT topic_id FROM phpbb3_posts ORDER BY post_id DESC LIMIT 1)) AS post_reply_number,
-                         phpbb3_posts.post_id AS number_id,
-                         COALESCE(phpbb3_ranks.rank_title, 'Registered User') AS group_title
-                         FROM phpbb3_posts
-                         INNER JOIN phpbb3_users ON phpbb3_posts.poster_id = phpbb3_users.user_id
-                         INNER JOIN phpbb3_forums ON phpbb3_forums.forum_id = phpbb3_posts.forum_id
-                         INNER JOIN phpbb3_topics ON phpbb3_topics.topic_id = phpbb3_posts.topic_id
-                         LEFT JOIN phpbb3_ranks ON phpbb3_ranks.rank_id = phpbb3_users.user_rank
-                         WHERE phpbb3_forums.forum_id NOT IN (1, 13, 16, 30, 31, 34)
-                         AND phpbb3_posts.post_visibility = 1
-                         ORDER BY phpbb3_posts.post_id DESC LIMIT 1
-                      """
-
-                cursor.execute(sql)
-                result = cursor.fetchone()
-
-                pid, tusername, ttitle, fid, tid, post_text, replynum, numberid, group = result
-
-                if pid in self.read_posts:
-                    return True
-
-                self.read_posts.append(pid)
-
-                if len(self.read_posts) == 1:
-                    return True
-
-                post_text = remove_tags(post_text)
-                length    = len(post_text)
-                post_text = post_text[:50]
-                if length > len(post_text):
-                    post_text += "..."
-
-                replymsg = "New topic!"
-                if replynum > 0:
-                    replymsg = "New reply!"
-
-                sm = """__**{ttitle}**__ - **{replymsg}** - {tusername} *({group})*
+            rows = await self.bot.db.run('forum', self.query_posts)
+            if rows is None:
+                return None
+
+            for result in rows:
+                await self.announce(result)
+                self.last_post.save(result[0])
+
+            return len(rows)
+        except Exception:
+            await self.bot.alert_error("Forum exception: {}".format(traceback.format_exc()))
+            return None
+
+    async def announce(self, result):
+        pid, tusername, ttitle, fid, tid, post_text, replynum, numberid, group = result
+
+        post_text = preview(post_text, 50)
+
+        replymsg = "New topic!"
+        if replynum > 0:
+            replymsg = "New reply!"
+
+        sm = """__**{ttitle}**__ - **{replymsg}** - {tusername} *({group})*
 https://thesirenboard.com/forums/viewtopic.php?f={fid}&t={tid}&p={numberid}#p{numberid}
 
 ```{post_text}```""".format(**locals())
 
-                await self.bot.isend(self.config['channels']['ars_forums'], sm)
-                return True
+        await self.bot.isend(self.config['channels']['ars_forums'], sm)
+
+    def open_listener(self):
+        # Runs on a database worker thread
+        if not re.match(r'^[a-z_][a-z0-9_]*$', self.listen_channel):
+            raise ValueError("Invalid notify_channel {!r}".format(self.listen_channel))
+
+        listener = self.connectDb()
+        try:
+            with listener.cursor() as cursor:
+                if self.install_trigger and not self.trigger_checked:
+                    self.ensure_trigger(cursor)
+                    self.trigger_checked = True
+                cursor.execute("LISTEN {}".format(self.listen_channel))
         except Exception:
-            await self.bot.alert_error("Forum exception: {}".format(traceback.format_exc()))
-            return False
-        finally:
-            self.closeDb()
+            listener.close()
+            raise
+        return listener
+
+    def ensure_trigger(self, cursor):
+        # Once per run; reconnects only LISTEN again
+        cursor.execute(TRIGGER_EXISTS, (self.listen_channel + '_trigger',))
+        if cursor.fetchone() is None:
+            print("Forum: installing {}_trigger on phpbb3_posts".format(self.listen_channel))
+            cursor.execute(NOTIFY_TRIGGER.format(channel=self.listen_channel))
+
+    async def listen(self):
+        self.listen_attempt = time.monotonic()
+        try:
+            self.listener = await self.bot.db.run('forum', self.open_listener)
+        except Exception as ex:
+            print("Forum: LISTEN unavailable, polling instead: {}".format(ex))
+            return
+
+        # Keep the fd, a dead connection raises on fileno()
+        self.listener_fd = self.listener.fileno()
+        self.bot.discord.loop.add_reader(self.listener_fd, self.on_notify)
+
+    def close_listener(self):
+        if self.listener is None:
+            return
+        self.bot.discord.loop.remove_reader(self.listener_fd)
+        self.listener_fd = None
+        try:
+            self.listener.close()
+        except Exception:
+            pass
+        self.listener = None
+
+    def on_notify(self):
+        try:
+            self.listener.poll()
+        except Exception as ex:
+            print("Forum: lost LISTEN connection, polling instead: {}".format(ex))
+            self.close_listener()
+            self.wakeup.set()
+            return
+
+        if self.listener.notifies:
+            del self.listener.notifies[:]
+            self.wakeup.set()
 
     async def check(self):
         await self.bot.discord.wait_until_ready()
         while not self.bot.discord.is_closed:
-            if not await self.fetch_post():
-                await asyncio.sleep(30)
+            if self.listen_enabled and self.listener is None and (self.listen_attempt is None or
+                    time.monotonic() - self.listen_attempt > self.listen_timeout):
+                await self.listen()
+
+            found = await self.fetch_post()
+            self.poller.record(found)
+            if found is not None and self.listener is not None:
+                # Still poll now and then in case a notification got lost
+                await self.poller.wait(self.wakeup, self.listen_timeout)
             else:
-                await asyncio.sleep(int(self.config['forums']['check_rate']))
-
-    def closeDb(self):
-        if self.forumdb is not None:
-            self.forumdb.close()
+                await self.poller.wait()
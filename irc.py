@@ -1,10 +1,12 @@
 from discord import PrivateChannel
 import asyncio
-import re
+import random
 import time
-import select
-import socket
 import sys
+import traceback
+
+from ircframe import LineFramer
+from ircqueue import Outbox
 
 class IRCManager:
     def __init__(self, bot):
@@ -20,70 +22,107 @@ class IRCManager:
         self.ircaccount = self.config['irc']['account']
         self.ircpass = self.config['irc']['password']
         self.authserv = self.config['irc']['nickserv']
-        self.irc_general_relay = self.config['irc']['relaychannel']
-        self.irc_mapping_relay = self.config['irc']['mappingchannel']
-        self.ircsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.ircsock.settimeout(0)
+        self.reader = None
+        self.writer = None
         self.ischecked = False
-        self.buffer = b''
-        self.length = None
-        self.readready = False
-        self.writeready = False
-        self.sendbuf = []
+        self.state = 'disconnected'
+        self.reconnect_min = self.config['irc'].get('reconnect_min', 5)
+        self.reconnect_max = self.config['irc'].get('reconnect_max', 300)
+        self.reconnects = 0
+        self.reached_001 = False
+        self.down_since = time.monotonic()
+        self.downtime = 0.0
+        self.framer = LineFramer()
+        self.outbox = Outbox(
+            rate=self.config['irc'].get('flood_rate', 2),
+            burst=self.config['irc'].get('flood_burst', 5),
+            max_depth=self.config['irc'].get('outbox_max', 500),
+            overflow=self.config['irc'].get('outbox_overflow', 'merge'),
+            observe=self.observe_line)
+        self.outbox.hold()
+        metrics = bot.metrics
+        self.lines_received = metrics.counter('irc_lines_received_total', 'Lines read from the IRC server')
+        self.handle_time = metrics.histogram('irc_handle_seconds', 'Time spent handling one IRC line')
+        self.relay_latency = metrics.histogram('relay_latency_seconds',
+            'Time a relayed line waits between arriving and being delivered', ('direction',))
+        metrics.gauge('irc_connected', 'Whether the IRC session is registered',
+            func=lambda: self.state == 'connected')
+        metrics.gauge('irc_outbox_depth', 'Lines waiting in the IRC outbox', func=lambda: len(self.outbox))
+        metrics.counter('irc_lines_sent_total', 'Lines written to the IRC server', func=lambda: self.outbox.sent)
+        metrics.counter('irc_lines_dropped_total', 'Lines dropped from a full IRC outbox',
+            func=lambda: self.outbox.dropped)
+        metrics.counter('irc_lines_discarded_total', 'Chat lines discarded while IRC was not registered',
+            func=lambda: self.outbox.discarded)
+        metrics.counter('irc_reconnects_total', 'IRC reconnect attempts', func=lambda: self.reconnects)
+        metrics.counter('irc_downtime_seconds_total', 'Seconds spent without a registered IRC session',
+            func=lambda: self.stats()['downtime'])
+
+    def observe_line(self, line, wait):
+        if line.startswith('PRIVMSG '):
+            self.relay_latency.labels('discord_to_irc').observe(wait)
+
+    def queue_line(self, line):
+        self.outbox.put(line)
 
     def privmsg(self, target, data):
-        self.sendbuf.append("PRIVMSG %s :%s\n" % (target, data))
+        self.queue_line("PRIVMSG %s :%s\n" % (target, data))
 
     async def onprivmsg(self, nick, channel, message):
-        formatted = "[IRC] {}: {}".format(nick, message)
-        if 'mapping' in channel:
-            await self.bot.isend(self.config['channels']['ars_mapping'], formatted)
-        else:
-            await self.bot.isend(self.config['channels']['ars_general'], formatted)
+        cid = self.bot.router.discord_for(channel)
+        if cid:
+            await self.bot.isend(cid, "[IRC] {}: {}".format(nick, message))
 
     async def irc_both(self, message):
-        chans = [self.config['channels']['ars_general'], self.config['channels']['ars_mapping']]
-        for chan in chans:
-            await self.bot.isend(chan, message)
+        for cid in self.bot.router.relayed:
+            await self.bot.isend(cid, message)
 
     def idandjoin(self):
         if self.ircchannels:
             for channel in self.ircchannels:
-                self.sendbuf.append("JOIN {}\n".format(channel))
+                self.queue_line("JOIN {}\n".format(channel))
         if self.ircaccount and self.authserv:
             self.privmsg(self.authserv, "LOGIN {} {}".format(self.ircaccount, self.ircpass))
 
     async def dc_callback(self):
-        self.ircsock.close()
-        time.sleep(10)
-        self.ircsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.ircsock.settimeout(0)
-        asyncio.ensure_future(self.loop())
+        # The connection task notices the closed stream and reconnects
+        self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+        self.outbox.hold()
+        if self.state != 'disconnected':
+            self.state = 'disconnected'
+            self.down_since = time.monotonic()
+
+    def registered(self):
+        self.state = 'connected'
+        self.reached_001 = True
+        self.outbox.release()
+        if self.down_since is not None:
+            self.downtime += time.monotonic() - self.down_since
+            self.down_since = None
+
+    def stats(self):
+        downtime = self.downtime
+        if self.down_since is not None:
+            downtime += time.monotonic() - self.down_since
+        return {
+            'state': self.state,
+            'reconnects': self.reconnects,
+            'downtime': downtime,
+        }
 
     def socksend(self, data):
-        d = data.encode('utf-8')
-        try:
-            self.ircsock.send(d)
-        except BlockingIOError as e:
-            print("socksend: {}".format(e))
-            pass
-
-    def decode_irc_string(self, string):
-        try:
-            return string.decode('UTF-8')
-        except UnicodeDecodeError:
-            try:
-                return string.decode('iso-8859-1')
-            except UnicodeDecodeError:
-                return string.decode('ascii', 'ignore')
-
-    async def relay_discord_general(self, content, message):
-        m = "<{}> {}".format(message.author.name, content)
-        self.privmsg(self.irc_general_relay, m)
+        if self.writer is None:
+            return
+        self.writer.write(data.encode('utf-8'))
 
-    async def relay_discord_mapping(self, content, message):
+    async def relay_discord(self, target, content, message):
         m = "<{}> {}".format(message.author.name, content)
-        self.privmsg(self.irc_mapping_relay, m)
+        self.privmsg(target, m)
 
     async def on_message(self, message):
         if str(message.author.id) == str(self.bot.discord.user.id):
@@ -92,173 +131,152 @@ class IRCManager:
         if isinstance(message.channel, PrivateChannel):
             return
 
-        new_message = str(message.content)
-
-        regex = re.compile("<@!(.+?)>")
-        matches = regex.findall(new_message)
-
-        def name_from_id(member_id):
-            for server in self.discord.servers:
-                for member in server.members:
-                    if member_id == str(member.id):
-                        return "@{}".format(member.display_name)
-            return '@Unknown'
-
-        for match in matches:
-            new_name = name_from_id(match)
-            new_message = re.sub(regex, new_name, new_message, 1)
+        target = self.bot.router.irc_for(message.channel.id)
+        if target is None:
+            return
 
-        if message.channel.name == 'general':
-            await self.relay_discord_general(new_message, message)
-        elif message.channel.name == 'mapping':
-            await self.relay_discord_mapping(new_message, message)
+        new_message = self.bot.members.translate(str(message.content))
+        await self.relay_discord(target, new_message, message)
 
     async def connect(self):
         self.ischecked = False
+        self.reached_001 = False
+        self.state = 'connecting'
         try:
-            self.ircsock.connect((self.server, self.port))
-        except BlockingIOError as e:
-            if e.errno != 115:
-                print("connect: {}".format(e))
-            pass
+            self.reader, self.writer = await asyncio.open_connection(self.server, self.port)
+        except OSError as e:
+            print("connect: {}".format(e))
+            self.state = 'disconnected'
+            return False
+
+        self.state = 'registering'
+        self.framer.reset()
 
-        self.sendbuf.append("USER " + self.ident + " " + self.botnick + " " + self.botnick + " :" + self.real + " \n")
-        self.sendbuf.append("NICK " + self.botnick + "\n")
+        self.outbox.hold()
+        self.queue_line("USER " + self.ident + " " + self.botnick + " " + self.botnick + " :" + self.real + " \n")
+        self.queue_line("NICK " + self.botnick + "\n")
 
         if self.ircpass and self.ircpass != "":
-            self.sendbuf.append("PASS " + self.ircpass + "\n")
+            self.queue_line("PASS " + self.ircpass + "\n")
 
         return True
 
     async def loop(self):
         await self.bot.discord.wait_until_ready()
-        self.readready = False
-        self.writeready = False
-        self.buffer = b''
-        self.length = None
-        while not await self.connect():
-            await self.connect()
-            await asyncio.sleep(.1)
-
+        delay = self.reconnect_min
         while not self.bot.discord.is_closed:
-            await self.check_socket()
-            await self.read_data()
-            await self.write_data()
-            await asyncio.sleep(.1)
-
-    async def check_socket(self):
-        rready, wready, err = select.select([self.ircsock], [self.ircsock], [])
-        for s in rready:
-            if s == self.ircsock:
-                self.readready = True
-        for s in wready:
-            if s == self.ircsock:
-                self.writeready = True
-
-    async def write_data(self):
-        if not self.writeready:
-            return
-
-        if not self.sendbuf:
-            return
-
-        i = self.sendbuf.pop(0)
-        self.socksend(i)
-
-    async def read_data(self):
-        if not self.readready: return
-
+            if await self.connect():
+                await self.session()
+                if self.reached_001:
+                    # We made it all the way through registration
+                    delay = self.reconnect_min
+                self.close()
+            self.reconnects += 1
+
+            if self.bot.discord.is_closed:
+                break
+
+            wait = delay * random.uniform(0.5, 1.5)
+            print("IRC: reconnecting in {:.1f}s".format(wait))
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, self.reconnect_max)
+
+    async def session(self):
+        tasks = [asyncio.ensure_future(self.read_loop()),
+                 asyncio.ensure_future(self.write_loop())]
         try:
-            ircmsg = self.ircsock.recv(2048)
-        except BlockingIOError as e:
-            self.readready = False
-            return
-
-        msg = b''
-
-        if not ircmsg:
-            return
-
-        self.buffer += ircmsg
-        if self.length is None:
-            if '\n' not in self.decode_irc_string(self.buffer):
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                print("IRC: connection lost: {}".format(task.exception()))
+
+    async def read_loop(self):
+        while not self.bot.discord.is_closed and self.reader is not None:
+            ircmsg = await self.reader.read(2048)
+            if not ircmsg:
+                break
+            await self.read_data(ircmsg)
+
+    async def write_loop(self):
+        writer = self.writer
+        while not self.bot.discord.is_closed and self.writer is writer:
+            i = await self.outbox.get()
+            self.socksend(i)
+            await writer.drain()
+
+    async def read_data(self, ircmsg):
+        for line in self.framer.feed(ircmsg):
+            if self.writer is None:
+                break
+            self.lines_received.inc()
+            try:
+                with self.handle_time.time():
+                    await self.handle_line(line)
+            except Exception:
+                await self.bot.alert_error("IRC exception: {}".format(traceback.format_exc()))
+
+    async def handle_line(self, m):
+        st2a = m.split(' ')
+        tokens = len(st2a)
+
+        if tokens > 1:
+            if st2a[0] == "ERROR" and st2a[1] == ":Closing":
+                await self.dc_callback()
                 return
 
-            sp = self.decode_irc_string(self.buffer).split('\n')
-            i = 0
-            lens = len(sp)
-            for line in sp:
-                self.length = len(line)
-                msg += b'\n' + self.buffer[:self.length]
-                self.buffer = self.buffer[self.length:]
-                self.length = None
-
-                if i + 1 == sp[i+1] != '':
-                    return
-
-        for mm in self.decode_irc_string(msg).split('\n'):
-
-            m = mm.strip('\n')
-
-            st2a = m.split(' ')
-            tokens = len(st2a)
-
-            if tokens > 1:
-                if st2a[0] == "ERROR" and st2a[1] == ":Closing":
-                    await self.dc_callback()
-                    break
-
-                if st2a[0] == "PING":
-                    self.sendbuf.append('PONG %s\n' % (st2a[1].strip(':')))
-
-                if st2a[1] == "001":
-                    self.idandjoin()
-
-            if tokens > 3:
-                if '#' in st2a[2] and st2a[1] == "PRIVMSG":
-                    nick = m.split('!')[0][1:]
-                    channel = m.split(' PRIVMSG ')[-1].split(' :')[0]
-                    message = m.split(':', 2)[2]
-                    m2a = message.split(' ')
-                    if nick.lower() not in self.config['irc']['ignore_nicks']:
-                        await self.onprivmsg(nick, channel, message)
-
-            if tokens > 2:
-                if not self.ischecked and st2a[1] == "513" and st2a[2] == str(botnick):
-                    self.sendbuf.append('PONG %s %s\n' % (botnick, st2a[8].strip(':')))
-                    self.ischecked = True
-
-                if 'NICK' == st2a[1]:
-                    nick = m.split('!')[0][1:]
-                    newnick = m.split()[2][1:]
-                    nick_message = "[IRC] *** {} changes nickname to {}".format(nick, newnick)
-                    await self.irc_both(nick_message)
-
-                if 'JOIN' == st2a[1]:
-                    nick = m.split('!')[0][1:]
-                    if 'JOIN' in nick or ' ' in nick: return
-                    chan = m.split()[2].lower()
-                    if ' ' in chan: return
-                    if nick == self.botnick: return
-                    join_message = "[IRC] *** {} has joined".format(nick)
-                    if 'airraidsirens' in chan:
-                        await self.bot.isend(self.config['channels']['ars_general'], join_message)
-                    elif 'mapping' in chan:
-                        await self.bot.isend(self.config['channels']['ars_mapping'], join_message)
-
-                if 'PART' == st2a[1]:
-                    nick = m.split('!')[0][1:]
-                    if 'PART' in nick or ' ' in nick: return
-                    chan = m.split()[2].lower()
-                    if ' ' in chan: return
-                    part_message = "[IRC] *** {} has left".format(nick)
-                    if 'airraidsirens' in chan:
-                        await self.bot.isend(self.config['channels']['ars_general'], part_message)
-                    elif 'mapping' in chan:
-                        await self.bot.isend(self.config['channels']['ars_mapping'], part_message)
-
-                if 'QUIT' == st2a[1]:
-                    nick = m.split('!')[0][1:]
-                    if nick == self.botnick: return
-                    quit_message = "[IRC] *** {} has quit".format(nick)
-                    await self.irc_both(quit_message)
+            if st2a[0] == "PING":
+                self.queue_line('PONG %s\n' % (st2a[1].strip(':')))
+
+            if st2a[1] == "001":
+                self.registered()
+                self.idandjoin()
+
+        if tokens > 3:
+            if '#' in st2a[2] and st2a[1] == "PRIVMSG":
+                nick = m.split('!')[0][1:]
+                channel = m.split(' PRIVMSG ')[-1].split(' :')[0]
+                message = m.split(':', 2)[2]
+                m2a = message.split(' ')
+                if nick.lower() not in self.config['irc']['ignore_nicks']:
+                    await self.onprivmsg(nick, channel, message)
+
+        if tokens > 2:
+            if not self.ischecked and st2a[1] == "513" and st2a[2] == str(self.botnick):
+                self.queue_line('PONG %s %s\n' % (self.botnick, st2a[8].strip(':')))
+                self.ischecked = True
+
+            if 'NICK' == st2a[1]:
+                nick = m.split('!')[0][1:]
+                newnick = m.split()[2][1:]
+                nick_message = "[IRC] *** {} changes nickname to {}".format(nick, newnick)
+                await self.irc_both(nick_message)
+
+            if 'JOIN' == st2a[1]:
+                nick = m.split('!')[0][1:]
+                if 'JOIN' in nick or ' ' in nick: return
+                chan = m.split()[2].lstrip(':')
+                if ' ' in chan: return
+                if nick == self.botnick: return
+                join_message = "[IRC] *** {} has joined".format(nick)
+                cid = self.bot.router.discord_for(chan)
+                if cid:
+                    await self.bot.isend(cid, join_message)
+
+            if 'PART' == st2a[1]:
+                nick = m.split('!')[0][1:]
+                if 'PART' in nick or ' ' in nick: return
+                chan = m.split()[2].lstrip(':')
+                if ' ' in chan: return
+                part_message = "[IRC] *** {} has left".format(nick)
+                cid = self.bot.router.discord_for(chan)
+                if cid:
+                    await self.bot.isend(cid, part_message)
+
+            if 'QUIT' == st2a[1]:
+                nick = m.split('!')[0][1:]
+                if nick == self.botnick: return
+                quit_message = "[IRC] *** {} has quit".format(nick)
+                await self.irc_both(quit_message)
@@ -0,0 +1,77 @@
+MAX_LINE = 512
+
+def decode_irc_string(string):
+    try:
+        return string.decode('UTF-8')
+    except UnicodeDecodeError:
+        try:
+            return string.decode('iso-8859-1')
+        except UnicodeDecodeError:
+            return string.decode('ascii', 'ignore')
+
+class LineFramer:
+    """Split a raw IRC byte stream into decoded lines.
+
+    Lines are cut on b'\\n' (with an optional preceding b'\\r') before any
+    decoding happens, so multibyte text can never shift the framing.  Each
+    line is decoded exactly once.  A line longer than max_line bytes
+    (terminator included, as per RFC 1459) is truncated on a UTF-8 boundary
+    and the rest of it is thrown away, which keeps the buffer bounded no
+    matter what the server sends.
+    """
+
+    def __init__(self, max_line=MAX_LINE):
+        self.max_line = max_line
+        self.buffer = bytearray()
+        self.discarding = False
+
+    def reset(self):
+        del self.buffer[:]
+        self.discarding = False
+
+    def truncate(self, start, stop):
+        limit = start + self.max_line - 2
+        if stop <= limit:
+            return stop
+        # Don't cut a UTF-8 sequence in half
+        while limit > start and (self.buffer[limit] & 0xC0) == 0x80:
+            limit -= 1
+        return limit
+
+    def emit(self, lines, start, stop):
+        if stop > start:
+            lines.append(decode_irc_string(bytes(self.buffer[start:self.truncate(start, stop)])))
+
+    def feed(self, data):
+        buf = self.buffer
+        buf += data
+        lines = []
+        start = 0
+
+        while True:
+            end = buf.find(b'\n', start)
+            if end < 0:
+                break
+
+            if self.discarding:
+                self.discarding = False
+            else:
+                stop = end
+                if stop > start and buf[stop - 1] == 13:
+                    stop -= 1
+                self.emit(lines, start, stop)
+
+            start = end + 1
+
+        if not self.discarding and len(buf) - start > self.max_line:
+            # Overlong line with no terminator in sight, deliver what
+            # fits and drop everything up to the next newline.
+            self.emit(lines, start, len(buf))
+            self.discarding = True
+
+        if self.discarding:
+            del buf[:]
+        else:
+            del buf[:start]
+
+        return lines
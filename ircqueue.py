@@ -0,0 +1,128 @@
+import asyncio
+import time
+from collections import deque
+
+from ratelimit import TokenBucket
+
+PRIORITY_COMMANDS = ('PING', 'PONG', 'JOIN', 'NICK', 'USER', 'PASS')
+
+class Outbox:
+    """Outbound IRC lines, paced by a token bucket.
+
+    Protocol housekeeping (PING/PONG, JOIN, registration) goes through a
+    separate lane that is always drained first so it can never get stuck
+    behind relayed chat.  Chat is capped at max_depth lines; when full, a
+    new PRIVMSG is merged into the last queued one for the same target if
+    it fits, otherwise the oldest line is dropped (overflow = 'merge'), or
+    the oldest line is dropped straight away (overflow = 'drop').  observe,
+    if given, is called with (line, seconds queued) as each line leaves.
+
+    While held, between losing a connection and registering on the next
+    one, chat is refused and only the priority lane is sent.  Lines sent
+    before 001 or JOIN would only be rejected by the server.
+    """
+
+    def __init__(self, rate=2, burst=5, max_depth=500, overflow='merge', observe=None):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_depth = max_depth
+        self.overflow = overflow
+        self.observe = observe
+        self.priority = deque()
+        self.normal = deque()
+        self.ready = asyncio.Event()
+        self.open = True
+        self.sent = 0
+        self.dropped = 0
+        self.discarded = 0
+        self.merged = 0
+        self.peak = 0
+
+    def __len__(self):
+        return len(self.priority) + len(self.normal)
+
+    def put(self, line):
+        entry = (time.monotonic(), line)
+        if line.split(' ', 1)[0].upper() in PRIORITY_COMMANDS:
+            self.priority.append(entry)
+        elif not self.open:
+            self.discarded += 1
+            return
+        elif len(self.normal) < self.max_depth:
+            self.normal.append(entry)
+        elif self.overflow == 'merge' and self.merge(line):
+            self.merged += 1
+        else:
+            self.normal.popleft()
+            self.normal.append(entry)
+            self.dropped += 1
+
+        self.peak = max(self.peak, len(self))
+        self.ready.set()
+
+    def merge(self, line):
+        if not self.normal:
+            return False
+
+        stamp, last = self.normal[-1]
+        if not last.startswith('PRIVMSG ') or not line.startswith('PRIVMSG '):
+            return False
+
+        head, sep, text = line.rstrip('\n').partition(' :')
+        if not sep or not last.startswith(head + ' :'):
+            return False
+
+        combined = "{} | {}\n".format(last.rstrip('\n'), text)
+        if len(combined.encode('utf-8')) > 512:
+            return False
+
+        self.normal[-1] = (stamp, combined)
+        return True
+
+    def hold(self):
+        """Drop everything queued and refuse chat until release()."""
+        self.open = False
+        self.priority.clear()
+        self.discarded += len(self.normal)
+        self.normal.clear()
+
+    def release(self):
+        self.open = True
+        if self.normal:
+            self.ready.set()
+
+    def pending(self):
+        return bool(self.priority) or (self.open and bool(self.normal))
+
+    async def get(self):
+        while True:
+            if not self.pending():
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+
+            delay = self.bucket.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            self.bucket.take()
+            self.sent += 1
+            if self.priority:
+                stamp, line = self.priority.popleft()
+            else:
+                stamp, line = self.normal.popleft()
+
+            if self.observe is not None:
+                self.observe(line, time.monotonic() - stamp)
+            return line
+
+    def stats(self):
+        return {
+            'depth': len(self.normal),
+            'priority_depth': len(self.priority),
+            'peak': self.peak,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'discarded': self.discarded,
+            'merged': self.merged,
+        }
@@ -2,45 +2,126 @@
 import asyncio
 import configparser
 import discord
+import signal
 import traceback
 import yaml
 
+from dbexec import DatabaseExecutor
 from dcmanage import DCManager
+from dcqueue import Coalescer
+from dispatch import Dispatcher
 from irc import IRCManager
+from members import MemberIndex
+from metrics import Registry
+from routing import Router
 from forums import Forum
 from toys import Random
+from watchdog import LagMonitor
 from wiki import Wiki
 
+REQUIRED_SECTIONS = ('discord', 'irc', 'channels')
+
 class Bot:
     def __init__(self):
         self.discord = discord.Client()
         self.config = None
         self.check_config()
+        self.metrics = Registry()
+        self.send_time = self.metrics.histogram('discord_send_seconds', 'Round trip of one Discord send')
+        self.queue_time = self.metrics.histogram('discord_queue_seconds',
+            'Time a line waits in the Discord outbox before it is sent')
+        self.query_time = self.metrics.histogram('db_query_seconds', 'Database worker call time', ('backend',))
+        self.members = MemberIndex(self.discord)
+        self.router = Router(self)
+        sendconf = self.config.get('discord_send', {})
+        self.outbox = Coalescer(self.send_now,
+            delay=sendconf.get('delay', 0.25),
+            rate=sendconf.get('rate', 1),
+            burst=sendconf.get('burst', 5),
+            observe=self.observe_send)
+        dbconf = self.config.get('database', {})
+        self.db = DatabaseExecutor(self.discord.loop,
+            workers=dbconf.get('workers', 4),
+            limits=dbconf.get('limits', {'forum': 1, 'wiki': 1, 'bans': 1}),
+            timeout=dbconf.get('timeout', 30),
+            observe=lambda backend, seconds: self.query_time.labels(backend).observe(seconds))
+        self.metrics.gauge('discord_outbox_depth', 'Lines waiting in the Discord outbox',
+            func=self.outbox.depth)
+        self.metrics.counter('discord_messages_total', 'Messages sent through the Discord outbox',
+            func=lambda: self.outbox.messages)
+        self.metrics.counter('db_timeouts_total', 'Database calls that timed out', func=lambda: self.db.timeouts)
         self.forumdb = Forum(self)
         self.wikidb = Wiki(self)
+        for stat, doc in (('created', 'Database connections opened'),
+                          ('closed', 'Database connections closed'),
+                          ('failed', 'Database connections that failed to open'),
+                          ('retried', 'Database calls retried on a new connection')):
+            family = self.metrics.counter('db_connections_{}_total'.format(stat), doc, ('backend',))
+            for pool in (self.forumdb.pool, self.wikidb.pool):
+                family.track(lambda pool=pool, stat=stat: pool.stats()[stat], pool.name)
         self.random = Random(self)
         self.dcmanager = DCManager(self)
         self.ircmanager = IRCManager(self)
+        self.dispatcher = Dispatcher(self)
+        self.watchdog = LagMonitor(self)
+        self.dcmanager.register_commands(self.dispatcher)
+        self.dispatcher.listen(self.random.on_message)
+        self.dispatcher.listen(self.ircmanager.on_message)
         # Discord events
         self.discord.event(self.on_ready)
         self.discord.event(self.on_message)
         self.discord.event(self.on_member_join)
+        self.discord.event(self.on_member_remove)
+        self.discord.event(self.on_member_update)
+        self.discord.event(self.on_server_join)
+        self.discord.event(self.on_server_remove)
+        self.discord.event(self.on_server_role_create)
+        self.discord.event(self.on_server_role_update)
+        self.discord.event(self.on_server_role_delete)
+        self.discord.event(self.on_channel_delete)
 
     async def on_ready(self):
         print('Logged in as {} ({})'.format(self.discord.user.name, self.discord.user.id))
         print('------')
+        self.members.rebuild()
 
     async def on_message(self, message):
-        await self.dcmanager.on_message(message)
-        await self.random.on_message(message)
-
-        asyncio.ensure_future(self.ircmanager.on_message(message))
+        await self.dispatcher.dispatch(message)
 
     async def on_member_join(self, member):
+        self.members.add(member)
         server = member.server
         if not await self.dcmanager.is_join_ban(member):
             fmt = 'Welcome {0.mention} to {1.name}! Here is a quick guide on getting started https://goo.gl/QhfUkQ'
-            await self.isend(self.config['channels']['ars_general'], fmt.format(member, server))
+            await self.isend(self.router.names.get('ars_general'), fmt.format(member, server))
+
+    async def on_member_remove(self, member):
+        self.members.remove(member)
+
+    async def on_member_update(self, before, after):
+        self.members.add(after)
+
+    async def on_server_join(self, server):
+        self.members.add_server(server)
+
+    async def on_server_remove(self, server):
+        self.members.rebuild()
+        self.router.forget_all()
+
+    async def on_server_role_create(self, role):
+        self.members.add_role(role)
+        self.dcmanager.forget_roles(role.server)
+
+    async def on_server_role_update(self, before, after):
+        self.members.add_role(after)
+        self.dcmanager.forget_roles(after.server)
+
+    async def on_server_role_delete(self, role):
+        self.members.remove_role(role)
+        self.dcmanager.forget_roles(role.server)
+
+    async def on_channel_delete(self, channel):
+        self.router.forget(channel.id)
 
     def check_config(self):
         try:
@@ -52,22 +133,69 @@ class Bot:
             print("You must supply a valid config file.")
             exit()
 
+    def reload_config(self):
+        try:
+            config = yaml.load(open('config.yml', 'r'))
+        except (OSError, yaml.YAMLError):
+            asyncio.ensure_future(self.alert_error(traceback.format_exc()))
+            return
+
+        if not isinstance(config, dict):
+            asyncio.ensure_future(self.alert_error("Not reloading config.yml: it is empty or not a mapping"))
+            return
+
+        missing = [section for section in REQUIRED_SECTIONS if not isinstance(config.get(section), dict)]
+        if missing:
+            asyncio.ensure_future(self.alert_error("Not reloading config.yml: missing {}".format(', '.join(missing))))
+            return
+
+        try:
+            self.router.build(config)
+        except (KeyError, TypeError, AttributeError) as ex:
+            asyncio.ensure_future(self.alert_error("Not reloading config.yml: {}: {}".format(type(ex).__name__, ex)))
+            return
+
+        # Everything holds a reference to this dict, update it in place
+        self.config.clear()
+        self.config.update(config)
+        print("Configuration reloaded")
+
+    async def start_metrics(self):
+        conf = self.config.get('metrics', {})
+        host = conf.get('host', '127.0.0.1')
+        port = int(conf.get('port', 9464))
+        try:
+            await self.metrics.serve(host, port)
+        except OSError as ex:
+            await self.alert_error("Unable to serve metrics on {}:{}: {}".format(host, port, ex))
+            return
+        print("Serving metrics on http://{}:{}/metrics".format(host, port))
+
+    def observe_send(self, cid, latency):
+        self.queue_time.observe(latency)
+        if cid in self.router.relayed:
+            self.ircmanager.relay_latency.labels('irc_to_discord').observe(latency)
+
     def get_channel(self, name):
-        t = str(self.config['channels'][name])
-        return self.discord.get_channel(t)
+        return self.router.named(name)
 
     async def isend(self, cid, message):
         if not cid:
-            self.alert_error("No channel ID specified.")
+            await self.alert_error("No channel ID specified.")
+            return
+
+        self.outbox.put(cid, message)
 
-        channel = self.discord.get_channel(cid)
+    async def send_now(self, cid, message):
+        channel = self.router.channel(cid)
 
         if channel is None:
             await self.alert_error("isend: Could not find channel! cid = {}, message = {}".format(cid, message))
             return
 
         try:
-            await self.discord.send_message(channel, message)
+            with self.send_time.time():
+                await self.discord.send_message(channel, message)
         except discord.errors.InvalidArgument as ex:
             print("Error sending via isend: {}".format(ex))
 
@@ -106,6 +234,11 @@ def main():
         bot.discord.loop.create_task(bot.wikidb.check())
         bot.discord.loop.create_task(bot.ircmanager.loop())
         bot.discord.loop.create_task(bot.dcmanager.loop())
+        if bot.config.get('metrics', {}).get('enabled', False):
+            bot.discord.loop.create_task(bot.start_metrics())
+        if bot.config.get('watchdog', {}).get('enabled', False):
+            bot.discord.loop.create_task(bot.watchdog.run())
+        bot.discord.loop.add_signal_handler(signal.SIGHUP, bot.reload_config)
         bot.discord.run(key)
     except discord.errors.LoginFailure:
         print("Invalid token specified: %s" % (key))
@@ -0,0 +1,161 @@
+import re
+
+MENTION = re.compile(r'<(@!?|@&|#)(\d+)>')
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class ServerMembers:
+    """Name lookups for the members of one server.
+
+    Keeps exact lowercase display names and a trigram index for substring
+    searches, so resolving a user never walks the whole member list.
+    Queries shorter than three characters have no trigram to look up and
+    scan every name instead.
+    """
+
+    def __init__(self):
+        self.by_id = {}
+        self.names = {}
+        self.by_name = {}
+        self.grams = {}
+
+    def add(self, member):
+        name = member.display_name.lower()
+        if self.names.get(member.id) == name:
+            # Presence updates and the like, nothing to reindex
+            self.by_id[member.id] = member
+            self.by_name[name][member.id] = member
+            return
+
+        self.remove(member.id)
+        self.by_id[member.id] = member
+        self.names[member.id] = name
+        self.by_name.setdefault(name, {})[member.id] = member
+        for gram in trigrams(name):
+            self.grams.setdefault(gram, set()).add(member.id)
+
+    def remove(self, member_id):
+        name = self.names.pop(member_id, None)
+        if name is None:
+            return
+        del self.by_id[member_id]
+
+        named = self.by_name[name]
+        del named[member_id]
+        if not named:
+            del self.by_name[name]
+
+        for gram in trigrams(name):
+            ids = self.grams[gram]
+            ids.discard(member_id)
+            if not ids:
+                del self.grams[gram]
+
+    def get(self, member_id):
+        return self.by_id.get(str(member_id))
+
+    def exact(self, name):
+        named = self.by_name.get(name.lower())
+        if not named:
+            return None
+        return next(iter(named.values()))
+
+    def containing(self, text):
+        text = text.lower()
+        if len(text) < 3:
+            return [self.by_id[i] for i, name in sorted(self.names.items()) if text in name]
+
+        sets = sorted((self.grams.get(gram, set()) for gram in trigrams(text)), key=len)
+        ids = set(sets[0]).intersection(*sets[1:])
+        return [self.by_id[i] for i in sorted(ids) if text in self.names[i]]
+
+    def search(self, query):
+        """Resolve a user the way moderators type them: an ID or exact
+        display name wins outright, otherwise every name containing it."""
+        member = self.get(query) or self.exact(query)
+        if member is not None:
+            return [member]
+        return self.containing(query)
+
+class MemberIndex:
+    """Member and role names by ID, kept current from Discord events.
+
+    Discord mentions only carry IDs; resolving them used to mean walking
+    every member of every server.  The index is filled on ready and then
+    patched by the member/role/server events the bot forwards to it.
+    """
+
+    def __init__(self, discord):
+        self.discord = discord
+        self.names = {}
+        self.roles = {}
+        self.servers = {}
+
+    def rebuild(self):
+        self.names.clear()
+        self.roles.clear()
+        self.servers.clear()
+        for server in self.discord.servers:
+            self.add_server(server)
+
+    def add_server(self, server):
+        self.servers[server.id] = ServerMembers()
+        for member in server.members:
+            self.add(member)
+        for role in server.roles:
+            self.add_role(role)
+
+    def server(self, server):
+        members = self.servers.get(server.id)
+        if members is None:
+            self.add_server(server)
+            members = self.servers[server.id]
+        return members
+
+    def add(self, member):
+        self.names[member.id] = member.display_name
+        members = self.servers.get(member.server.id)
+        if members is not None:
+            members.add(member)
+
+    def search(self, server, query):
+        return self.server(server).search(query)
+
+    def get(self, server, member_id):
+        return self.server(server).get(member_id)
+
+    def remove(self, member):
+        members = self.servers.get(member.server.id)
+        if members is not None:
+            members.remove(member.id)
+
+        # Still around on another server, keep that name instead
+        for server in self.discord.servers:
+            other = server.get_member(member.id)
+            if other is not None and other is not member:
+                self.names[member.id] = other.display_name
+                return
+        self.names.pop(member.id, None)
+
+    def add_role(self, role):
+        self.roles[role.id] = role.name
+
+    def remove_role(self, role):
+        self.roles.pop(role.id, None)
+
+    def display_name(self, member_id):
+        return self.names.get(str(member_id))
+
+    def replace_mention(self, match):
+        kind, ident = match.groups()
+        if kind == '#':
+            channel = self.discord.get_channel(ident)
+            return '#{}'.format(channel.name if channel else 'deleted-channel')
+        if kind == '@&':
+            return '@{}'.format(self.roles.get(ident, 'deleted-role'))
+        return '@{}'.format(self.names.get(ident, 'Unknown'))
+
+    def translate(self, content):
+        """Rewrite user, role and channel mentions into readable names."""
+        return MENTION.sub(self.replace_mention, content)
@@ -0,0 +1,185 @@
+import asyncio
+import bisect
+import time
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in pairs) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.func = None
+
+    def inc(self, n=1):
+        self.value += n
+
+    def samples(self, name, labels):
+        value = self.func() if self.func is not None else self.value
+        return ['{}{} {}'.format(name, labels(), format_value(value))]
+
+class Gauge(Counter):
+    def set(self, value):
+        self.value = value
+
+    def dec(self, n=1):
+        self.value -= n
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return Timer(self)
+
+    def samples(self, name, labels):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            lines.append('{}_bucket{} {}'.format(name, labels((('le', format_value(bound)),)), total))
+        lines.append('{}_sum{} {}'.format(name, labels(), format_value(self.sum)))
+        lines.append('{}_count{} {}'.format(name, labels(), self.count))
+        return lines
+
+class Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.start)
+
+class Family:
+    """One named metric, optionally split by label values.
+
+    Without labels the family forwards inc/set/observe/time to its only
+    child.  func, when given, is called at scrape time for the value
+    (counters and gauges only) - handy for numbers a subsystem already
+    keeps, such as queue depths.  track() does the same for one labelled
+    child.
+    """
+
+    def __init__(self, kind, name, doc, labelnames, func, make):
+        self.kind = kind
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.func = func
+        self.make = make
+        self.children = {}
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.make()
+        return child
+
+    def track(self, func, *values):
+        """Read one labelled counter or gauge from func at scrape time."""
+        self.labels(*values).func = func
+
+    def inc(self, n=1):
+        self.labels().inc(n)
+
+    def dec(self, n=1):
+        self.labels().dec(n)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.doc), '# TYPE {} {}'.format(self.name, self.kind)]
+        if self.func is not None:
+            lines.append('{} {}'.format(self.name, format_value(self.func())))
+            return lines
+
+        for values, child in sorted(self.children.items()):
+            labels = lambda extra=(), values=values: format_labels(self.labelnames, values, extra)
+            lines.extend(child.samples(self.name, labels))
+        return lines
+
+class Registry:
+    """Process-wide metrics, rendered in the Prometheus text format."""
+
+    def __init__(self, prefix='ars_'):
+        self.prefix = prefix
+        self.families = {}
+
+    def add(self, kind, name, doc, labels, func, make):
+        name = self.prefix + name
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = Family(kind, name, doc, labels, func, make)
+        return family
+
+    def counter(self, name, doc, labels=(), func=None):
+        return self.add('counter', name, doc, labels, func, Counter)
+
+    def gauge(self, name, doc, labels=(), func=None):
+        return self.add('gauge', name, doc, labels, func, Gauge)
+
+    def histogram(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        return self.add('histogram', name, doc, labels, None, lambda: Histogram(buckets))
+
+    def render(self):
+        lines = []
+        for name in sorted(self.families):
+            try:
+                lines.extend(self.families[name].render())
+            except Exception as ex:
+                print("Metrics: unable to collect {}: {}".format(name, ex))
+        return '\n'.join(lines) + '\n'
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.render().encode('utf-8')
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+
+            writer.write('HTTP/1.0 {}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                         'Content-Length: {}\r\nConnection: close\r\n\r\n'.format(status, len(body)).encode('latin-1'))
+            writer.write(body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=9464):
+        return await asyncio.start_server(self.handle, host, port)
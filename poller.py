@@ -0,0 +1,97 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+class Poller:
+    """Adaptive interval for a polling loop.
+
+    A poll that finds something drops the interval straight back to
+    min_interval, so bursts of activity are picked up quickly.  Empty or
+    failed polls double it, up to max_interval, so a quiet source is left
+    alone.  Every sleep is jittered by +/- jitter so several pollers
+    don't settle into lockstep.
+    """
+
+    def __init__(self, source, metrics, min_interval=1, max_interval=60, backoff=2, jitter=0.2):
+        self.source = source
+        self.min_interval = float(min_interval)
+        self.max_interval = max(float(max_interval), self.min_interval)
+        self.backoff = backoff
+        self.jitter = jitter
+        self.interval = self.min_interval
+        self.polls = 0
+        self.hits = 0
+        self.errors = 0
+        self.items = 0
+        self.recent = deque(maxlen=60)
+        self.polls_total = metrics.counter('polls_total', 'Database polls', ('source',)).labels(source)
+        self.hits_total = metrics.counter('poll_hits_total', 'Database polls that found new rows',
+            ('source',)).labels(source)
+        self.items_total = metrics.counter('poll_items_total', 'Rows announced by the database pollers',
+            ('source',)).labels(source)
+        self.errors_total = metrics.counter('poll_errors_total', 'Failed database polls', ('source',)).labels(source)
+        self.interval_gauge = metrics.gauge('poll_interval_seconds', 'Current poll interval',
+            ('source',)).labels(source)
+        self.interval_gauge.set(self.interval)
+        self.rate_gauge = metrics.gauge('poll_rate_per_minute', 'Recent polls per minute',
+            ('source',)).labels(source)
+        self.hit_ratio_gauge = metrics.gauge('poll_hit_ratio', 'Share of polls that found new rows',
+            ('source',)).labels(source)
+
+    def record(self, found):
+        """found is the number of new rows, or None if the poll failed."""
+        self.polls += 1
+        self.polls_total.inc()
+        self.recent.append(time.monotonic())
+
+        if found is None:
+            self.errors += 1
+            self.errors_total.inc()
+        elif found:
+            self.hits += 1
+            self.items += found
+            self.hits_total.inc()
+            self.items_total.inc(found)
+
+        if found:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        self.interval_gauge.set(self.interval)
+        self.rate_gauge.set(self.rate())
+        self.hit_ratio_gauge.set(self.hits / self.polls)
+
+    def delay(self):
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def wait(self, wakeup=None, timeout=None):
+        """Sleep until the next poll is due, or until wakeup is set."""
+        delay = self.delay() if timeout is None else timeout
+        if wakeup is None:
+            await asyncio.sleep(delay)
+            return
+
+        try:
+            await asyncio.wait_for(wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+
+    def rate(self):
+        """Polls per minute over the last few dozen polls."""
+        if len(self.recent) < 2:
+            return 0.0
+        elapsed = self.recent[-1] - self.recent[0]
+        return 60.0 * (len(self.recent) - 1) / elapsed if elapsed > 0 else 0.0
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'polls': self.polls,
+            'hits': self.hits,
+            'errors': self.errors,
+            'items': self.items,
+            'hit_ratio': self.hits / self.polls if self.polls else 0.0,
+            'rate': self.rate(),
+        }
@@ -0,0 +1,62 @@
+import html
+import re
+
+# phpBB 3.0/3.1 stored BBCode inline, tagged with the post's bbcode_uid.
+# It is matched as a whole, arguments can hold entities such as
+# [quote=&quot;Bob&quot;:2k3j4h5g] or [url=http&#58;//...:2k3j4h5g].
+TOKEN = re.compile(r'''
+    (?P<comment><!--.*?-->)
+  | <(?P<close>/)?(?P<tag>[A-Za-z][\w:.-]*)[^>]*?(?P<empty>/)?>
+  | (?P<bbcode>\[/?[^\[\]\s=]+?(?:=[^\[\]]*?)?:[0-9a-z]{5,8}\])
+  | &(?P<entity>\#?[A-Za-z0-9]+);
+  | (?P<text>[^<&\[]+)
+  | (?P<other>[<&\[])
+''', re.X | re.S)
+
+# s9e TextFormatter (phpBB >= 3.2): <s>/<e> hold the original [tag] and
+# [/tag], <i> holds ignored characters.  Only the rest is visible text.
+# Case matters, BBCode elements are upper case (<I> is [i]).
+MARKERS = ('s', 'e', 'i')
+
+def is_formatted(text):
+    return text.startswith(('<r>', '<t>', '<r ', '<t '))
+
+def visible(text):
+    """Yield the visible text of an HTML/phpBB post, piece by piece.
+
+    Tags, comments and BBCode markers are skipped and entities decoded
+    one at a time, so a caller that stops early never pays for the rest
+    of the post.
+    """
+    formatted = is_formatted(text)
+    hidden = 0
+
+    for m in TOKEN.finditer(text):
+        kind = m.lastgroup
+        if kind == 'text' or kind == 'other':
+            if not hidden:
+                yield m.group()
+        elif kind == 'bbcode':
+            # s9e posts keep their BBCode in <s>/<e>, this is just text there
+            if formatted and not hidden:
+                yield m.group()
+        elif kind == 'entity':
+            if not hidden:
+                yield html.unescape(m.group())
+        elif kind != 'comment' and formatted and not m.group('empty'):
+            if m.group('tag') in MARKERS:
+                if m.group('close'):
+                    hidden = max(hidden - 1, 0)
+                else:
+                    hidden += 1
+
+def preview(text, limit=50, more='...'):
+    """The first limit visible characters of text, plus more if cut."""
+    parts = []
+    length = 0
+    for chunk in visible(text):
+        parts.append(chunk)
+        length += len(chunk)
+        if length > limit:
+            return ''.join(parts)[:limit] + more
+    return ''.join(parts)
@@ -0,0 +1,28 @@
+import time
+
+class TokenBucket:
+    """Classic token bucket, refilled lazily on every call."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, n=1):
+        """Seconds to wait before n tokens are available."""
+        self.refill()
+        if self.tokens >= n:
+            return 0
+        return (n - self.tokens) / self.rate
+
+    def take(self, n=1):
+        if self.delay(n) > 0:
+            return False
+        self.tokens -= n
+        return True
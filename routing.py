@@ -0,0 +1,67 @@
+class Router:
+    """IRC <-> Discord relay pairs and resolved Discord channels.
+
+    Built once from the config (and again on reload) so the relay never
+    has to look at config strings per message.  irc.relays lists the pairs
+    as {irc: '#channel', discord: '<key in channels>'}; without it the old
+    relaychannel/mappingchannel settings are used.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.build()
+
+    def build(self, config=None):
+        # Everything is worked out before anything is replaced, so a bad
+        # config raises and leaves the current routes alone.
+        if config is None:
+            config = self.bot.config
+        relays = config['irc'].get('relays')
+        if relays is None:
+            relays = [
+                {'irc': config['irc']['relaychannel'], 'discord': 'ars_general'},
+                {'irc': config['irc']['mappingchannel'], 'discord': 'ars_mapping'},
+            ]
+
+        names = {name: str(cid) for name, cid in config['channels'].items() if cid}
+        irc_to_discord = {}
+        discord_to_irc = {}
+        for relay in relays:
+            cid = names.get(relay['discord'])
+            if cid is None:
+                print("Router: no channel configured for {}".format(relay['discord']))
+                continue
+            irc_to_discord[relay['irc'].lower()] = cid
+            discord_to_irc[cid] = relay['irc']
+
+        self.names = names
+        self.irc_to_discord = irc_to_discord
+        self.discord_to_irc = discord_to_irc
+        self.relayed = list(discord_to_irc)
+        self.channels = {}
+
+    def discord_for(self, irc_channel):
+        return self.irc_to_discord.get(irc_channel.lower())
+
+    def irc_for(self, cid):
+        return self.discord_to_irc.get(str(cid))
+
+    def channel(self, cid):
+        if not cid:
+            return None
+        cid = str(cid)
+        channel = self.channels.get(cid)
+        if channel is None:
+            channel = self.bot.discord.get_channel(cid)
+            if channel is not None:
+                self.channels[cid] = channel
+        return channel
+
+    def named(self, name):
+        return self.channel(self.names.get(name))
+
+    def forget(self, cid):
+        self.channels.pop(str(cid), None)
+
+    def forget_all(self):
+        self.channels = {}
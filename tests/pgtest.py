@@ -0,0 +1,108 @@
+"""Shared PostgreSQL fixtures for the forum tests.
+
+Tests that need a server are skipped unless ARS_TEST_DSN holds a libpq
+connection string for a role allowed to create databases, e.g.
+
+    ARS_TEST_DSN='host=127.0.0.1 user=postgres' python3 -m pytest tests
+"""
+import os
+import unittest
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+DSN = os.environ.get('ARS_TEST_DSN', '')
+
+requires_postgres = unittest.skipUnless(psycopg2 is not None and DSN,
+    'set ARS_TEST_DSN to run against PostgreSQL')
+
+# Column subset of the phpBB 3.2 schema, with its indexes
+TABLES = """
+CREATE TABLE phpbb3_forums (
+    forum_id serial PRIMARY KEY,
+    forum_name varchar(255) NOT NULL DEFAULT ''
+);
+CREATE TABLE phpbb3_ranks (
+    rank_id serial PRIMARY KEY,
+    rank_title varchar(255) NOT NULL DEFAULT ''
+);
+CREATE TABLE phpbb3_users (
+    user_id serial PRIMARY KEY,
+    username varchar(255) NOT NULL DEFAULT '',
+    user_rank integer NOT NULL DEFAULT 0
+);
+CREATE TABLE phpbb3_topics (
+    topic_id serial PRIMARY KEY,
+    forum_id integer NOT NULL DEFAULT 0,
+    topic_title varchar(255) NOT NULL DEFAULT '',
+    topic_first_post_id integer NOT NULL DEFAULT 0,
+    topic_posts_approved integer NOT NULL DEFAULT 0
+);
+CREATE INDEX phpbb3_topics_forum_id ON phpbb3_topics (forum_id);
+CREATE TABLE phpbb3_posts (
+    post_id serial PRIMARY KEY,
+    topic_id integer NOT NULL DEFAULT 0,
+    forum_id integer NOT NULL DEFAULT 0,
+    poster_id integer NOT NULL DEFAULT 0,
+    post_visibility smallint NOT NULL DEFAULT 0,
+    post_text text NOT NULL DEFAULT ''
+);
+CREATE INDEX phpbb3_posts_topic_id ON phpbb3_posts (topic_id);
+CREATE INDEX phpbb3_posts_forum_id ON phpbb3_posts (forum_id);
+CREATE INDEX phpbb3_posts_poster_id ON phpbb3_posts (poster_id);
+CREATE INDEX phpbb3_posts_post_visibility ON phpbb3_posts (post_visibility);
+"""
+
+# Ten posts per topic on average, with one megathread holding every tenth
+# post (the newest included) and every fiftieth post awaiting approval
+SEED = """
+INSERT INTO phpbb3_forums (forum_name) SELECT 'Forum ' || i FROM generate_series(1, 40) i;
+INSERT INTO phpbb3_ranks (rank_title) SELECT 'Rank ' || i FROM generate_series(1, 10) i;
+INSERT INTO phpbb3_users (username, user_rank)
+    SELECT 'user' || i, i %% 12 FROM generate_series(1, %(users)s) i;
+INSERT INTO phpbb3_topics (forum_id, topic_title)
+    SELECT 1 + i %% 40, 'Topic ' || i FROM generate_series(1, %(topics)s) i;
+INSERT INTO phpbb3_posts (topic_id, forum_id, poster_id, post_visibility, post_text)
+    SELECT t, 1 + t %% 40, 1 + (i::bigint * 7919) %% %(users)s, CASE WHEN i %% 50 = 0 THEN 0 ELSE 1 END,
+           '<t>' || repeat('Some siren talk ', 1 + i %% 40) || '</t>'
+    FROM (SELECT i, CASE WHEN i %% 10 = 0 THEN 1 ELSE 1 + (i::bigint * 104729) %% %(topics)s END AS t
+          FROM generate_series(1, %(posts)s) i) s;
+UPDATE phpbb3_topics SET topic_first_post_id = first.post_id, topic_posts_approved = first.posts
+    FROM (SELECT topic_id, MIN(post_id) AS post_id, COUNT(*) AS posts FROM phpbb3_posts GROUP BY topic_id) first
+    WHERE first.topic_id = phpbb3_topics.topic_id;
+"""
+
+def seed(cursor, posts):
+    cursor.execute(SEED, {'posts': posts, 'topics': max(posts // 10, 1), 'users': max(posts // 200, 1)})
+    cursor.execute('ANALYZE')
+
+def connect(**kwargs):
+    conn = psycopg2.connect(DSN, **kwargs)
+    conn.autocommit = True
+    return conn
+
+class ScratchDatabase:
+    """A throwaway database holding the phpBB tables."""
+
+    def __init__(self, name):
+        self.name = name
+        self.admin = connect()
+        with self.admin.cursor() as cursor:
+            cursor.execute('DROP DATABASE IF EXISTS {0} WITH (FORCE)'.format(name))
+            cursor.execute('CREATE DATABASE {0}'.format(name))
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(TABLES)
+        finally:
+            conn.close()
+
+    def connect(self):
+        return connect(dbname=self.name)
+
+    def drop(self):
+        with self.admin.cursor() as cursor:
+            cursor.execute('DROP DATABASE IF EXISTS {0} WITH (FORCE)'.format(self.name))
+        self.admin.close()
@@ -0,0 +1,133 @@
+"""Offline stand-ins for the parts of discord.py the tests and benchmarks touch."""
+import sys
+import time
+import types
+
+from metrics import Registry
+
+class PrivateChannel:
+    pass
+
+class InvalidArgument(Exception):
+    pass
+
+def install_discord():
+    """Make 'import discord' work without discord.py installed."""
+    try:
+        import discord
+    except ImportError:
+        module = types.ModuleType('discord')
+        module.PrivateChannel = PrivateChannel
+        module.errors = types.SimpleNamespace(InvalidArgument=InvalidArgument,
+                                              LoginFailure=InvalidArgument)
+        sys.modules['discord'] = module
+
+class User:
+    def __init__(self, id, name):
+        self.id = str(id)
+        self.name = name
+        self.display_name = name
+
+class Role:
+    def __init__(self, id, name, server):
+        self.id = str(id)
+        self.name = name
+        self.server = server
+        self.is_everyone = name == '@everyone'
+
+class Member(User):
+    def __init__(self, id, name, server):
+        super().__init__(id, name)
+        self.server = server
+        self.roles = [server.default_role]
+        self.mention = '<@{}>'.format(self.id)
+
+class Channel:
+    def __init__(self, id, name, voice=False):
+        self.id = str(id)
+        self.name = name
+        self.type = types.SimpleNamespace(voice=voice)
+        self.voice_members = []
+
+class Server:
+    def __init__(self, id, members, roles=('shadow ban', 'timeout', 'member', 'mapper')):
+        self.id = str(id)
+        self.name = 'server{}'.format(id)
+        self.default_role = Role(id, '@everyone', self)
+        self.roles = [self.default_role] + [Role(id * 100 + i, name, self) for i, name in enumerate(roles, 1)]
+        self.channels = [Channel(id * 100 + 1, 'general'), Channel('263542134026665985', 'banned', voice=True)]
+        self._members = {}
+        for i in range(members):
+            member = Member(10 ** 17 + i, 'user{}'.format(i), self)
+            member.roles.extend(self.roles[3:])
+            self._members[member.id] = member
+
+    @property
+    def members(self):
+        return self._members.values()
+
+    def get_member(self, id):
+        return self._members.get(str(id))
+
+class Client:
+    """Counts every REST call instead of making it."""
+
+    def __init__(self):
+        self.is_closed = False
+        self.user = User(1, 'bot')
+        self.servers = []
+        self.channels = {}
+        self.api_calls = {}
+
+    async def wait_until_ready(self):
+        pass
+
+    def get_channel(self, cid):
+        return self.channels.get(str(cid))
+
+    def count(self, name):
+        self.api_calls[name] = self.api_calls.get(name, 0) + 1
+
+    async def send_message(self, destination, content):
+        self.count('send_message')
+
+    async def replace_roles(self, member, *roles):
+        self.count('replace_roles')
+
+    async def add_roles(self, member, *roles):
+        self.count('add_roles')
+
+    async def remove_roles(self, member, *roles):
+        self.count('remove_roles')
+
+    async def move_member(self, member, channel):
+        self.count('move_member')
+
+class Bot:
+    """Just enough of main.Bot for a single subsystem.
+
+    isend records (monotonic time, channel id, message) instead of
+    talking to Discord.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.discord = Client()
+        self.metrics = Registry()
+        self.sent = []
+        self.errors = []
+        self.on_send = None
+
+    async def isend(self, cid, message):
+        self.sent.append((time.perf_counter(), cid, message))
+        if self.on_send is not None:
+            self.on_send(cid, message)
+
+    async def alert_error(self, e):
+        self.errors.append(e)
+
+    async def alert_debug(self, e):
+        pass
+
+    async def debug_notify(self, e):
+        pass
@@ -0,0 +1,56 @@
+import asyncio
+import os
+import sys
+import time
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dcmanage import DCManager
+
+def manager(rate, burst, concurrency=4):
+    # Only the bulk ban state, none of the Discord or database wiring
+    dc = DCManager.__new__(DCManager)
+    dc.bulk_slots = asyncio.Semaphore(concurrency)
+    dc.bulk_rate = rate
+    dc.bulk_burst = burst
+    dc.bulk_buckets = {}
+    dc.started = []
+
+    async def parse_ban(origin, ban_type, banner, server, target, ban_time, message):
+        dc.started.append((time.monotonic(), server.id, target))
+
+    dc.parse_ban = parse_ban
+    return dc
+
+class BulkBanTest(unittest.TestCase):
+    def test_paced_after_burst(self):
+        async def run():
+            dc = manager(rate=20, burst=2)
+            server = types.SimpleNamespace(id='1')
+            start = time.monotonic()
+            await dc.bulk_ban(None, 'timeout', None, server, ['a', 'b', 'c', 'd', 'e', ''], '1h', 'spam')
+            return start, dc.started
+
+        start, started = asyncio.run(run())
+        self.assertEqual(sorted(target for stamp, sid, target in started), ['a', 'b', 'c', 'd', 'e'])
+        # Two at once, then one every 50 ms
+        self.assertLess(started[1][0] - start, 0.02)
+        self.assertGreaterEqual(started[-1][0] - start, 0.14)
+
+    def test_servers_paced_separately(self):
+        async def run():
+            dc = manager(rate=1, burst=2)
+            start = time.monotonic()
+            await asyncio.gather(
+                dc.bulk_ban(None, 'timeout', None, types.SimpleNamespace(id='1'), ['a', 'b'], '1h', ''),
+                dc.bulk_ban(None, 'timeout', None, types.SimpleNamespace(id='2'), ['c', 'd'], '1h', ''))
+            return time.monotonic() - start, dc.started
+
+        elapsed, started = asyncio.run(run())
+        self.assertEqual(len(started), 4)
+        self.assertLess(elapsed, 0.1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,22 @@
+import os
+import unittest
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class ConfigExampleTest(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(ROOT, 'config.yaml.example')) as f:
+            self.config = yaml.safe_load(f)
+
+    def test_sections(self):
+        for section in ('discord', 'irc', 'channels', 'forums', 'discord_send'):
+            self.assertIsInstance(self.config.get(section), dict, section)
+
+    def test_irc_channels_stay_in_irc(self):
+        self.assertEqual(self.config['irc']['channels'], ['#airraidsirens', '#mapping'])
+        self.assertIn('ars_general', self.config['channels'])
+
+if __name__ == '__main__':
+    unittest.main()
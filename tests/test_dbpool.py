@@ -0,0 +1,83 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dbpool import ConnectionPool
+from metrics import Registry
+
+class Gone(Exception):
+    pass
+
+class FakeConnection:
+    def __init__(self, serial):
+        self.serial = serial
+        self.closed = False
+        self.dead = False
+
+    def close(self):
+        self.closed = True
+
+class PoolTest(unittest.TestCase):
+    def setUp(self):
+        self.made = []
+
+        def connect():
+            self.made.append(FakeConnection(len(self.made)))
+            return self.made[-1]
+
+        self.pool = ConnectionPool('test', connect, lambda conn: not conn.closed, size=2)
+
+    def query(self, conn):
+        if conn.dead:
+            raise Gone()
+        return conn.serial
+
+    def test_reuses_idle_connection(self):
+        self.assertEqual(self.pool.run(self.query), 0)
+        self.assertEqual(self.pool.run(self.query), 0)
+        self.assertEqual(self.pool.stats()['reused'], 1)
+
+    def test_retries_once_when_server_dropped_connection(self):
+        self.pool.run(self.query)
+        # Server restarted: the client still thinks the socket is open
+        self.made[0].dead = True
+        self.assertEqual(self.pool.run(self.query, retry=(Gone,)), 1)
+        self.assertTrue(self.made[0].closed)
+        self.assertEqual(self.pool.stats()['retried'], 1)
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+    def test_fresh_connection_failure_is_not_retried(self):
+        def always(conn):
+            raise Gone()
+        self.assertRaises(Gone, self.pool.run, always, (Gone,))
+        self.assertEqual(len(self.made), 1)
+
+    def test_second_failure_raises(self):
+        self.pool.run(self.query)
+        def always(conn):
+            raise Gone()
+        self.assertRaises(Gone, self.pool.run, always, (Gone,))
+        self.assertEqual(len(self.made), 2)
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+    def test_other_errors_are_not_retried(self):
+        self.pool.run(self.query)
+        def fails(conn):
+            raise ValueError()
+        self.assertRaises(ValueError, self.pool.run, fails, (Gone,))
+        self.assertEqual(len(self.made), 1)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+    def test_churn_exported_per_backend(self):
+        self.pool.run(self.query)
+        self.made[0].dead = True
+        self.pool.run(self.query, retry=(Gone,))
+        registry = Registry()
+        family = registry.counter('db_connections_created_total', 'Database connections opened', ('backend',))
+        family.track(lambda: self.pool.stats()['created'], self.pool.name)
+        self.assertIn('ars_db_connections_created_total{backend="test"} 2.0', registry.render())
+
+if __name__ == '__main__':
+    unittest.main()
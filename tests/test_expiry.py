@@ -0,0 +1,117 @@
+import asyncio
+import os
+import sys
+import time
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from banstore import Ban, BanCache
+from dcmanage import DCManager
+
+def manager():
+    # Only the expiry state, none of the Discord or database wiring
+    dc = DCManager.__new__(DCManager)
+    dc.expiries = []
+    dc.pending = {}
+    dc.cache = BanCache()
+    dc.store = types.SimpleNamespace(delete=lambda ids: None)
+    dc.unbanned = []
+    dc.deleted = []
+    dc.errors = []
+
+    async def alert_error(e):
+        dc.errors.append(e)
+
+    dc.bot = types.SimpleNamespace(alert_error=alert_error)
+
+    async def unban(*args):
+        dc.unbanned.append(time.time())
+
+    async def run_store(func, *args):
+        if func is dc.store.delete:
+            dc.deleted.extend(args[0])
+
+    dc.unban = unban
+    dc.run_store = run_store
+    return dc
+
+class ExpiryTest(unittest.TestCase):
+    def test_due_at_exact_second(self):
+        dc = manager()
+        dc.expiry_changed = asyncio.Event()
+        dc.schedule_expiry(1, 1000)
+        self.assertEqual(dc.due_expiries(999.9), [])
+        self.assertEqual(dc.due_expiries(1000), [1])
+        self.assertEqual(dc.pending, {})
+
+    def test_no_busy_loop_and_on_time(self):
+        async def run():
+            dc = manager()
+            dc.expiry_changed = asyncio.Event()
+            expires = int(time.time()) + 1
+            dc.cache.add(Ban(1, 1, 2, 'target', 3, 'mod', 'spam', expires, 'Timeout'))
+            dc.schedule_expiry(1, expires)
+
+            rounds = 0
+            while not dc.unbanned and rounds < 100:
+                rounds += 1
+                await dc.check_for_unbans()
+                if not dc.unbanned:
+                    await dc.wait_for_expiry()
+            return rounds, dc.unbanned[0] - expires
+
+        rounds, late = asyncio.run(run())
+        self.assertLessEqual(rounds, 3)
+        self.assertLess(late, 0.1)
+
+    def test_failed_unban_keeps_ban_and_retries(self):
+        async def run():
+            dc = manager()
+            dc.expiry_changed = asyncio.Event()
+            now = int(time.time())
+            for ban_id, target in ((1, 10), (2, 20)):
+                dc.cache.add(Ban(ban_id, 1, target, 'target', 3, 'mod', 'spam', now - 1, 'Timeout'))
+                dc.schedule_expiry(ban_id, now - 1)
+
+            async def unban(server_id, target_id, *args):
+                if target_id == 10:
+                    raise RuntimeError('403 FORBIDDEN')
+                dc.unbanned.append(target_id)
+
+            dc.unban = unban
+            await dc.check_for_unbans()
+            return dc
+
+        dc = asyncio.run(run())
+        self.assertEqual(dc.unbanned, [20])
+        self.assertEqual(dc.deleted, [2])
+        self.assertEqual(len(dc.errors), 1)
+        # Still banned, and due again later
+        self.assertIn(1, dc.cache.by_id)
+        self.assertNotIn(2, dc.cache.by_id)
+        self.assertGreater(dc.pending[1], time.time())
+
+    def test_failed_delete_keeps_ban_cached(self):
+        async def run():
+            dc = manager()
+            dc.expiry_changed = asyncio.Event()
+            now = int(time.time())
+            dc.cache.add(Ban(1, 1, 10, 'target', 3, 'mod', 'spam', now - 1, 'Timeout'))
+            dc.schedule_expiry(1, now - 1)
+
+            async def run_store(func, *args):
+                raise asyncio.TimeoutError()
+
+            dc.run_store = run_store
+            await dc.check_for_unbans()
+            return dc
+
+        dc = asyncio.run(run())
+        self.assertEqual(len(dc.errors), 1)
+        self.assertIn(1, dc.cache.by_id)
+        self.assertIn(1, dc.pending)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+sys.path.insert(0, ROOT)
+
+import stubs
+stubs.install_discord()
+
+from pgtest import ScratchDatabase, psycopg2, requires_postgres
+
+if psycopg2 is not None:
+    from dbexec import DatabaseExecutor
+    from forums import NOTIFY_TRIGGER, Forum
+
+CHANNEL = 'phpbb3_new_post'
+
+def config(install_trigger=False):
+    return {
+        'forum_mysql': {'user': '', 'db': ''},
+        'forums': {'listen': True, 'notify_channel': CHANNEL, 'listen_timeout': 300,
+                   'install_trigger': install_trigger},
+        'channels': {'ars_forums': '100'},
+    }
+
+async def woken(forum, timeout):
+    try:
+        await asyncio.wait_for(forum.wakeup.wait(), timeout)
+    except asyncio.TimeoutError:
+        return False
+    forum.wakeup.clear()
+    return True
+
+@requires_postgres
+class NotifyTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db = ScratchDatabase('ars_notify_test')
+        cls.writer = cls.db.connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.writer.close()
+        cls.db.drop()
+
+    def setUp(self):
+        self.execute('DROP TRIGGER IF EXISTS {0}_trigger ON phpbb3_posts'.format(CHANNEL))
+
+    def execute(self, sql, params=None):
+        with self.writer.cursor() as cursor:
+            cursor.execute(sql, params)
+            if cursor.description is not None:
+                return cursor.fetchall()
+
+    def trigger_oid(self):
+        rows = self.execute("SELECT oid FROM pg_trigger WHERE tgname = %s", (CHANNEL + '_trigger',))
+        return rows[0][0] if rows else None
+
+    def run_forum(self, check, install_trigger=False):
+        async def run():
+            loop = asyncio.get_running_loop()
+            errors = []
+            loop.set_exception_handler(lambda loop, context: errors.append(context.get('message')))
+            bot = stubs.Bot(config(install_trigger))
+            bot.discord.loop = loop
+            bot.db = DatabaseExecutor(loop, workers=2)
+            forum = Forum(bot)
+            forum.connectDb = self.db.connect
+            try:
+                await check(forum)
+            finally:
+                forum.close_listener()
+                bot.db.shutdown()
+            self.assertEqual(errors, [])
+        asyncio.run(run())
+
+    def test_wakes_for_visible_inserts_only(self):
+        self.execute(NOTIFY_TRIGGER.format(channel=CHANNEL))
+
+        async def check(forum):
+            await forum.listen()
+            self.assertIsNotNone(forum.listener)
+
+            self.execute("INSERT INTO phpbb3_posts (topic_id, post_visibility) VALUES (1, 1)")
+            self.assertTrue(await woken(forum, 5))
+
+            pending = self.execute("INSERT INTO phpbb3_posts (topic_id, post_visibility) "
+                                   "VALUES (1, 0) RETURNING post_id")[0][0]
+            self.assertFalse(await woken(forum, 0.5))
+
+            self.execute("UPDATE phpbb3_posts SET post_visibility = 1 WHERE post_id = %s", (pending,))
+            self.assertFalse(await woken(forum, 0.5))
+
+        self.run_forum(check)
+
+    def test_lost_connection_falls_back_to_polling(self):
+        async def check(forum):
+            await forum.listen()
+            self.execute("SELECT pg_terminate_backend(%s)", (forum.listener.get_backend_pid(),))
+            self.assertTrue(await woken(forum, 5))
+            self.assertIsNone(forum.listener)
+            self.assertIsNone(forum.listener_fd)
+
+        self.run_forum(check)
+
+    def test_trigger_left_alone_by_default(self):
+        async def check(forum):
+            await forum.listen()
+            self.assertIsNotNone(forum.listener)
+
+        self.run_forum(check)
+        self.assertIsNone(self.trigger_oid())
+
+    def test_trigger_installed_once(self):
+        oids = []
+
+        async def check(forum):
+            await forum.listen()
+            oids.append(self.trigger_oid())
+            # A reconnect only runs LISTEN
+            forum.close_listener()
+            await forum.listen()
+            self.assertIsNotNone(forum.listener)
+            oids.append(self.trigger_oid())
+
+        self.run_forum(check, install_trigger=True)
+        # Next run finds it in pg_trigger and leaves it in place
+        self.run_forum(check, install_trigger=True)
+        self.assertIsNotNone(oids[0])
+        self.assertEqual(set(oids), {oids[0]})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+sys.path.insert(0, ROOT)
+
+import stubs
+stubs.install_discord()
+
+from pgtest import ScratchDatabase, psycopg2, requires_postgres, seed
+
+if psycopg2 is not None:
+    from forums import NEW_POSTS
+
+POSTS = 100000
+
+def nodes(plan):
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from nodes(child)
+
+@requires_postgres
+class PollPlanTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db = ScratchDatabase('ars_plan_test')
+        cls.conn = cls.db.connect()
+        with cls.conn.cursor() as cursor:
+            seed(cursor, POSTS)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+        cls.db.drop()
+
+    def plan(self, mark):
+        with self.conn.cursor() as cursor:
+            cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + NEW_POSTS, (mark, [1, 13, 16, 30, 31, 34], 20))
+            return cursor.fetchone()[0][0]['Plan']
+
+    def assert_walks_primary_key(self, mark):
+        for node in nodes(self.plan(mark)):
+            self.assertFalse(node['Node Type'] == 'Seq Scan' and node.get('Relation Name') == 'phpbb3_posts',
+                             'sequential scan on phpbb3_posts')
+            self.assertNotIn(node.get('Parent Relationship'), ('SubPlan', 'InitPlan'))
+
+    def test_typical_poll(self):
+        # The watermark sits just behind the newest post
+        self.assert_walks_primary_key(POSTS - 30)
+
+    def test_idle_poll(self):
+        self.assert_walks_primary_key(POSTS)
+
+if __name__ == '__main__':
+    unittest.main()
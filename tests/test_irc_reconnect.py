@@ -0,0 +1,102 @@
+import asyncio
+import os
+import socket
+import sys
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+sys.path.insert(0, ROOT)
+
+import stubs
+stubs.install_discord()
+
+from irc import IRCManager
+from routing import Router
+
+def config(port):
+    return {
+        'irc': {
+            'ident': 'test', 'nick': 'Discord', 'realname': 'test',
+            'server': '127.0.0.1', 'port': port, 'channels': ['#a'],
+            'account': '', 'password': '', 'nickserv': '',
+            'relaychannel': '#a', 'mappingchannel': '#b', 'ignore_nicks': [],
+            'reconnect_min': 0.05, 'reconnect_max': 10,
+        },
+        'channels': {'ars_general': '100', 'ars_mapping': '200'},
+    }
+
+class ReconnectTest(unittest.TestCase):
+    def test_backoff_resets_after_registered_session(self):
+        async def run():
+            connects = []
+
+            async def handle(reader, writer):
+                connects.append(time.monotonic())
+                # Register, then get kicked the way a server restart does it
+                writer.write(b':fake 001 Discord :Welcome\r\nERROR :Closing Link: Discord (Restarting)\r\n')
+                await writer.drain()
+                try:
+                    await reader.read()
+                except ConnectionError:
+                    pass
+                writer.close()
+
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            bot = stubs.Bot(config(server.sockets[0].getsockname()[1]))
+            bot.router = Router(bot)
+            irc = IRCManager(bot)
+            task = asyncio.ensure_future(irc.loop())
+            try:
+                deadline = time.monotonic() + 10
+                while len(connects) < 6 and time.monotonic() < deadline:
+                    await asyncio.sleep(0.01)
+            finally:
+                bot.discord.is_closed = True
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                irc.close()
+                server.close()
+            return connects
+
+        connects = asyncio.run(run())
+        self.assertEqual(len(connects), 6)
+        gaps = [b - a for a, b in zip(connects, connects[1:])]
+        # Doubling would reach 0.8 s by the fifth reconnect
+        self.assertLess(max(gaps), 0.3, gaps)
+
+    def test_failed_connects_count_as_attempts(self):
+        async def run():
+            # Grab a free port and leave nothing listening on it
+            with socket.socket() as sock:
+                sock.bind(('127.0.0.1', 0))
+                port = sock.getsockname()[1]
+
+            bot = stubs.Bot(config(port))
+            bot.router = Router(bot)
+            irc = IRCManager(bot)
+            irc.queue_line('PRIVMSG #a :nobody is listening\n')
+            task = asyncio.ensure_future(irc.loop())
+            deadline = time.monotonic() + 5
+            while irc.reconnects < 2 and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            bot.discord.is_closed = True
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            return irc
+
+        irc = asyncio.run(run())
+        self.assertGreaterEqual(irc.reconnects, 2)
+        self.assertGreater(irc.stats()['downtime'], 0)
+        self.assertEqual(len(irc.outbox), 0)
+        self.assertIn('ars_irc_downtime_seconds_total', irc.bot.metrics.render())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ircframe import LineFramer, decode_irc_string
+
+class LineFramerTest(unittest.TestCase):
+    def feed_bytes(self, framer, data):
+        lines = []
+        for i in range(len(data)):
+            lines.extend(framer.feed(data[i:i + 1]))
+        return lines
+
+    def test_crlf_and_lf(self):
+        framer = LineFramer()
+        self.assertEqual(framer.feed(b'PING :a\r\nPING :b\nPING :c\r\n'), ['PING :a', 'PING :b', 'PING :c'])
+
+    def test_partial_line_is_held(self):
+        framer = LineFramer()
+        self.assertEqual(framer.feed(b'PRIVMSG #a :hel'), [])
+        self.assertEqual(framer.feed(b'lo\r'), [])
+        self.assertEqual(framer.feed(b'\n'), ['PRIVMSG #a :hello'])
+
+    def test_multibyte_byte_at_a_time(self):
+        text = 'PRIVMSG #a :Sirène 警報 🚨'
+        framer = LineFramer()
+        self.assertEqual(self.feed_bytes(framer, (text + '\r\n').encode('utf-8') * 2), [text, text])
+
+    def test_empty_lines_are_skipped(self):
+        framer = LineFramer()
+        self.assertEqual(framer.feed(b'\r\n\nPING :x\r\n'), ['PING :x'])
+
+    def test_latin1_fallback(self):
+        framer = LineFramer()
+        self.assertEqual(framer.feed(b'PRIVMSG #a :caf\xe9\r\n'), ['PRIVMSG #a :caf\xe9'])
+        self.assertEqual(decode_irc_string(b'caf\xc3\xa9'), 'caf\xe9')
+
+    def test_overlong_line_truncated_on_utf8_boundary(self):
+        framer = LineFramer(max_line=16)
+        # 13 ASCII bytes then a 3 byte character straddling the 14 byte cut
+        line = framer.feed(b'PRIVMSG #a :x' + '警報'.encode('utf-8') + b'\r\n')[0]
+        self.assertEqual(line, 'PRIVMSG #a :x')
+        self.assertLessEqual(len(line.encode('utf-8')), 14)
+
+    def test_overlong_line_discarded_until_newline(self):
+        framer = LineFramer(max_line=16)
+        lines = framer.feed(b'PRIVMSG #a :' + b'x' * 40)
+        self.assertEqual(lines, ['PRIVMSG #a :xx'])
+        self.assertTrue(framer.discarding)
+        self.assertEqual(framer.feed(b'y' * 1000), [])
+        self.assertEqual(len(framer.buffer), 0)
+        self.assertEqual(framer.feed(b'zzz\r\nPING :ok\r\n'), ['PING :ok'])
+        self.assertFalse(framer.discarding)
+
+    def test_overlong_multibyte_byte_at_a_time(self):
+        framer = LineFramer(max_line=16)
+        lines = self.feed_bytes(framer, ('é' * 30 + '\r\nPING :ok\r\n').encode('utf-8'))
+        self.assertEqual(lines, ['é' * 7, 'PING :ok'])
+
+    def test_reset(self):
+        framer = LineFramer()
+        framer.feed(b'PING :half')
+        framer.reset()
+        self.assertEqual(framer.feed(b'PING :new\r\n'), ['PING :new'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import sys
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from members import ServerMembers
+
+def member(id, name):
+    return types.SimpleNamespace(id=str(id), display_name=name)
+
+class SearchTest(unittest.TestCase):
+    def setUp(self):
+        self.members = ServerMembers()
+        for i, name in enumerate(['Crab', 'abby', 'Sirenfan', 'siren'], 1):
+            self.members.add(member(i, name))
+
+    def names(self, query):
+        return sorted(m.display_name for m in self.members.search(query))
+
+    def test_id_and_exact_name_win(self):
+        self.assertEqual(self.names('3'), ['Sirenfan'])
+        self.assertEqual(self.names('SIREN'), ['siren'])
+
+    def test_substring(self):
+        self.assertEqual(self.names('renf'), ['Sirenfan'])
+        self.assertEqual(self.names('rab'), ['Crab'])
+
+    def test_short_queries_match_anywhere(self):
+        self.assertEqual(self.names('ra'), ['Crab'])
+        self.assertEqual(self.names('ab'), ['Crab', 'abby'])
+        self.assertEqual(self.names('y'), ['abby'])
+
+    def test_rename_and_remove(self):
+        self.members.add(member(1, 'lobster'))
+        self.assertEqual(self.names('ra'), [])
+        self.members.remove('2')
+        self.assertEqual(self.names('ab'), [])
+        self.assertEqual(self.names('ste'), ['lobster'])
+
+if __name__ == '__main__':
+    unittest.main()
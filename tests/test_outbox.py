@@ -0,0 +1,45 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ircqueue import Outbox
+
+def drain(outbox):
+    async def run():
+        lines = []
+        while outbox.pending():
+            lines.append(await outbox.get())
+        return lines
+    return asyncio.run(run())
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.outbox = Outbox(rate=1000, burst=1000)
+
+    def test_held_outbox_refuses_chat(self):
+        self.outbox.hold()
+        self.outbox.put('PRIVMSG #a :during the outage\n')
+        self.outbox.put('NICK Discord\n')
+        self.assertEqual(drain(self.outbox), ['NICK Discord\n'])
+        self.assertEqual(self.outbox.discarded, 1)
+
+    def test_hold_discards_stale_chat(self):
+        self.outbox.put('PRIVMSG #a :queued\n')
+        self.outbox.put('PONG x\n')
+        self.outbox.hold()
+        self.assertEqual(len(self.outbox), 0)
+        self.assertEqual(self.outbox.discarded, 1)
+
+    def test_release_sends_joins_before_chat(self):
+        self.outbox.hold()
+        self.outbox.put('USER a b c :d\n')
+        self.outbox.release()
+        self.outbox.put('PRIVMSG #a :hello\n')
+        self.outbox.put('JOIN #a\n')
+        self.assertEqual(drain(self.outbox), ['USER a b c :d\n', 'JOIN #a\n', 'PRIVMSG #a :hello\n'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preview import preview
+
+class PreviewTest(unittest.TestCase):
+    def test_s9e_markers_hidden(self):
+        text = '<r><B><s>[b]</s>Hello<e>[/b]</e></B> &lt;3<br/>\n<I><s>[i]</s>it<e>[/i]</e></I></r>'
+        self.assertEqual(preview(text), 'Hello <3\nit')
+
+    def test_legacy_bbcode_with_entities(self):
+        text = '[quote=&quot;Bob&quot;:2k3j4h5g]quoted[/quote:2k3j4h5g] reply'
+        self.assertEqual(preview(text), 'quoted reply')
+
+    def test_legacy_bbcode_tags(self):
+        text = ('[url=http&#58;//example&#46;com:1a2b3c4d]link[/url:1a2b3c4d] [b:1a2b3c4d]x[/b:1a2b3c4d] '
+                '[list:1a2b3c4d][*:1a2b3c4d]a[/list:u:1a2b3c4d]')
+        self.assertEqual(preview(text), 'link x a')
+
+    def test_plain_brackets_kept(self):
+        self.assertEqual(preview('arr[0] = [1, 2] &amp; [tag]'), 'arr[0] = [1, 2] & [tag]')
+        self.assertEqual(preview('<t>literal [b:abcde] kept</t>'), 'literal [b:abcde] kept')
+
+    def test_truncation(self):
+        self.assertEqual(preview('<t>' + 'x' * 60 + '</t>'), 'x' * 50 + '...')
+        self.assertEqual(preview('<t>' + 'x' * 50 + '</t>'), 'x' * 50)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Module -> subsystem blamed for a stall caught inside it
+SUBSYSTEMS = {
+    'irc': 'irc',
+    'ircframe': 'irc',
+    'ircqueue': 'irc',
+    'forums': 'forums',
+    'wiki': 'wiki',
+    'dcmanage': 'bans',
+    'banstore': 'bans',
+    'members': 'members',
+    'routing': 'routing',
+    'dispatch': 'dispatch',
+    'dcqueue': 'discord',
+    'dbexec': 'database',
+    'dbpool': 'database',
+    'watermark': 'database',
+    'metrics': 'metrics',
+    'toys': 'toys',
+    'main': 'bot',
+}
+
+def blame(stack):
+    """Name the subsystem for a stack, innermost bot module first."""
+    for frame in reversed(stack):
+        path = os.path.abspath(frame.filename)
+        if os.path.dirname(path) != ROOT:
+            continue
+        module = os.path.splitext(os.path.basename(path))[0]
+        if module in SUBSYSTEMS:
+            return SUBSYSTEMS[module]
+
+    for frame in reversed(stack):
+        if '{0}discord{0}'.format(os.sep) in frame.filename:
+            return 'discord.py'
+    return 'other'
+
+class LagMonitor:
+    """Measure how late the event loop runs its callbacks.
+
+    A ticker on the loop sleeps for interval seconds and records how much
+    later than that it woke up.  A side thread watches the ticker; once it
+    has been silent for threshold seconds the loop is stuck in something
+    synchronous, so the thread grabs the loop thread's current stack and
+    works out which subsystem it belongs to.  The stall is reported when
+    the loop comes back, along with how long it lasted.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        conf = bot.config.get('watchdog', {})
+        self.interval = float(conf.get('interval', 0.25))
+        self.threshold = float(conf.get('threshold', 0.5))
+        self.alert = bool(conf.get('alert', False))
+        self.loop_thread = None
+        self.beat = time.monotonic()
+        self.caught = None
+        self.stalls = deque(maxlen=20)
+        self.lock = threading.Lock()
+        self.lag = bot.metrics.histogram('loop_lag_seconds', 'How late the event loop woke a sleeping task',
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+        self.stall_time = bot.metrics.histogram('loop_stall_seconds', 'Event loop stalls over the threshold',
+            ('subsystem',), buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120))
+
+    def watch(self):
+        while not self.bot.discord.is_closed:
+            time.sleep(self.interval / 2)
+            with self.lock:
+                beat = self.beat
+                if self.caught is not None or time.monotonic() - beat < self.threshold:
+                    continue
+                frame = sys._current_frames().get(self.loop_thread)
+                if frame is None:
+                    continue
+                stack = traceback.extract_stack(frame)
+                del frame
+                self.caught = (blame(stack), stack)
+
+    async def run(self):
+        self.loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        threading.Thread(target=self.watch, name='watchdog', daemon=True).start()
+
+        while not self.bot.discord.is_closed:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self.lag.observe(lag)
+
+            with self.lock:
+                self.beat = now
+                caught, self.caught = self.caught, None
+            if caught is not None:
+                await self.report(lag, *caught)
+
+    async def report(self, lag, subsystem, stack):
+        self.stall_time.labels(subsystem).observe(lag)
+        self.stalls.append((time.time(), lag, subsystem))
+        trace = ''.join(traceback.format_list(stack[-8:]))
+        print("Watchdog: event loop blocked for {:.2f}s in {}\n{}".format(lag, subsystem, trace))
+        if self.alert:
+            await self.bot.alert_debug("Event loop blocked for {:.2f}s in {}:\n```{}```".format(lag, subsystem, trace))
@@ -0,0 +1,27 @@
+import os
+
+class Watermark:
+    """An integer high-water mark persisted to a small file.
+
+    Pollers use it to remember the last row they announced, so a restart
+    neither re-announces old rows nor skips the ones that arrived while the
+    bot was down.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.value = self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def save(self, value):
+        self.value = value
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(value))
+        os.replace(tmp, self.path)